@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Sequential allocation of stage 2 replications.
+
+Rather than simulating every system taken forward from stage 1 up to
+the full n_2 replications, further replications are requested in small
+batches and only for systems whose chance constraints are still
+uncertain.  Bootstrap datasets are updated incrementally as each batch
+arrives instead of being recomputed from scratch.
+
+"""
+
+import numpy as np
+from numba import jit
+
+from bootcomp.bootstrap import bootstrap
+
+
+@jit(nopython=True, nogil=True)
+def online_bootstrap_update(data, weights, totals):
+    """
+    Fold a batch of new replications into existing bootstrap datasets.
+
+    Each new replication receives an independent Poisson(1) weight in
+    every bootstrap dataset.  This approximates multinomial resampling
+    and means that replications can be added to a bootstrap dataset
+    without redrawing it.
+
+    Keyword arguments:
+    data -- numpy array of new replications for a single system
+    weights -- numpy array (boots) of summed weights. Updated in place.
+    totals -- numpy array (boots) of weighted totals.  Updated in place.
+    """
+    for boot in range(weights.shape[0]):
+
+        for rep in range(data.shape[0]):
+
+            w = np.random.poisson(1.0)
+            weights[boot] += w
+            totals[boot] += w * data[rep]
+
+
+class OnlineBootstrap(object):
+    """
+    Incrementally updated bootstrap of the mean for k systems.
+
+    The initial replications are resampled in the usual way
+    (see bootstrap.bootstrap).  Replications that arrive later are added
+    with Poisson weights (see online_bootstrap_update).
+    """
+
+    def __init__(self, data, boots=1000):
+        """
+        Keyword arguments:
+        data -- list of numpy arrays of initial replications (one per system)
+        boots -- number of bootstrap datasets (default = 1000)
+        """
+        designs = len(data)
+        self.boots = boots
+        self.weights = np.empty((designs, boots))
+        self.totals = np.empty((designs, boots))
+        self.replications = [[np.asarray(d, dtype=np.float64)] for d in data]
+
+        for design in range(designs):
+            reps = self.replications[design][0]
+            self.weights[design] = reps.shape[0]
+            self.totals[design] = bootstrap(reps, boots) * reps.shape[0]
+
+    def update(self, design, data):
+        """
+        Add new replications for the system at position @design
+        """
+        data = np.asarray(data, dtype=np.float64)
+        if data.shape[0] == 0:
+            return
+        self.replications[design].append(data)
+        online_bootstrap_update(data, self.weights[design],
+                                self.totals[design])
+
+    def n_reps(self):
+        """
+        Returns a numpy array of the number of replications of each system
+        """
+        return np.array([sum(batch.shape[0] for batch in reps)
+                         for reps in self.replications])
+
+    def data(self, design):
+        """
+        Returns all replications of the system at position @design
+        """
+        return np.concatenate(self.replications[design])
+
+    def means(self):
+        """
+        Returns the bootstrap means (systems x boots)
+        """
+        return self.totals / self.weights
+
+
+def pass_proportions(means, threshold, kind='lower'):
+    """
+    Returns the proportion of bootstrap means for each system that meet
+    a chance constraint threshold.
+
+    Keyword arguments:
+    means -- numpy array of bootstrap means (systems x boots)
+    threshold -- the threshold of the chance constraint
+    kind -- 'lower' = a lower limit threshold; 'upper' = an upper
+             limit threshold (default = 'lower')
+    """
+    if kind.lower() == 'lower':
+        return (means >= threshold).mean(axis=1)
+
+    return (means <= threshold).mean(axis=1)
+
+
+def allocate_replications(uncertainty, batch_size, remaining):
+    """
+    Split a batch of replications between systems in proportion to
+    the uncertainty in their chance constraints.
+
+    Every system with non-zero uncertainty gets at least one replication.
+
+    Returns a numpy array of the number of replications to request
+    for each system.
+
+    Keyword arguments:
+    uncertainty -- numpy array of uncertainty weights (one per system)
+    batch_size -- total number of replications to allocate
+    remaining -- numpy array of the maximum replications each system
+                 can receive
+    """
+    allocation = np.zeros(uncertainty.shape[0], dtype=np.int64)
+    active = (uncertainty > 0) & (remaining > 0)
+
+    if not active.any():
+        return allocation
+
+    share = uncertainty[active] / uncertainty[active].sum()
+    allocation[active] = np.maximum(1, np.round(share * batch_size))
+
+    return np.minimum(allocation, remaining)
+
+
+def sequential_allocation(designs, stage_1, simulator, constraints, gamma,
+                          batch_size=20, max_reps=50, budget=None,
+                          nboots=1000, tol=0.01, method='mean'):
+    """
+    Sequentially allocate further replications to the systems taken
+    forward from stage 1 until their chance constraints are resolved.
+
+    After each batch the proportion q of bootstrap datasets meeting each
+    constraint is recalculated.  A system is resolved once a constraint
+    is clearly violated (q <= tol) or all constraints are clearly met
+    (q >= 1 - tol).  Unresolved systems receive the next batch in
+    proportion to q(1 - q) of their most uncertain constraint.
+
+    Returns a tuple of:
+    1. numpy array of the feasible systems (labels from @designs)
+    2. list (one per KPI) of lists of numpy arrays of all replications
+       of each system
+    3. numpy array (constraints x systems) of the final pass proportions
+
+    Keyword arguments:
+    designs -- labels of the systems taken forward from stage 1
+    stage_1 -- list (one per KPI) of numpy arrays (systems x replications)
+               of the stage 1 replications of @designs
+    simulator -- callable simulator(design, n) that returns a sequence
+                 (one per KPI) of numpy arrays of up to n new replications
+                 of the system labelled @design.  Returning fewer than n
+                 replications means no more are available.
+    constraints -- list of (kpi, threshold, kind) tuples where kpi is
+                   the position of the KPI within @stage_1 and kind is
+                   'lower' or 'upper'
+    gamma -- the probability cut off for the chance constraints
+    batch_size -- replications to allocate per round (default = 20)
+    max_reps -- maximum replications of any one system (default = 50)
+    budget -- maximum additional replications in total (default = None
+              i.e. limited only by @max_reps)
+    nboots -- the number of bootstrap datasets (default = 1000)
+    tol -- proportion used to decide a constraint is resolved
+           (default = 0.01)
+    method -- 'mean' = bootstrap the mean (as constraints_bootstrap);
+              'count' = bootstrap the proportion of replications meeting
+              the threshold (as constraints_bootstrap_r1)
+    """
+    #pylint: disable-msg=R0913,R0914
+
+    valid_operations = ['upper', 'lower']
+    valid_methods = ['mean', 'count']
+
+    if len(constraints) == 0:
+        raise ValueError('Parameter @constraints must contain at least one constraint')
+
+    for _, _, kind in constraints:
+        if kind.lower() not in valid_operations:
+            raise ValueError('Parameter @kind must be either set to lower or upper')
+
+    if method.lower() not in valid_methods:
+        raise ValueError('Parameter @method must be either set to mean or count')
+
+    designs = np.asarray(designs)
+    kpis = len(stage_1)
+    n_designs = designs.shape[0]
+
+    replications = [[np.asarray(stage_1[kpi][d], dtype=np.float64)
+                     for d in range(n_designs)] for kpi in range(kpis)]
+
+    online = [OnlineBootstrap(_constraint_data(replications[kpi], threshold,
+                                               kind, method), nboots)
+              for kpi, threshold, kind in constraints]
+
+    exhausted = np.zeros(n_designs, dtype=bool)
+    spent = 0
+
+    while True:
+        decision, props = _constraint_proportions(online, constraints,
+                                                  gamma, method)
+
+        infeasible = (decision <= tol).any(axis=0)
+        feasible = (decision >= 1 - tol).all(axis=0)
+        uncertainty = (decision * (1 - decision)).max(axis=0)
+        uncertainty[infeasible | feasible | exhausted] = 0
+
+        remaining = max_reps - online[0].n_reps()
+        round_size = batch_size
+        if budget is not None:
+            round_size = min(batch_size, budget - spent)
+
+        allocation = allocate_replications(uncertainty, round_size,
+                                           remaining)
+
+        if budget is not None:
+            allocation = _trim_to_budget(allocation, budget - spent)
+
+        if allocation.sum() == 0:
+            break
+
+        for design in np.flatnonzero(allocation):
+            new_reps = simulator(designs[design], allocation[design])
+            n_new = new_reps[0].shape[0]
+
+            if n_new < allocation[design]:
+                exhausted[design] = True
+
+            for kpi in range(kpis):
+                replications[kpi][design] = np.concatenate(
+                    [replications[kpi][design],
+                     np.asarray(new_reps[kpi], dtype=np.float64)])
+
+            for boots, (kpi, threshold, kind) in zip(online, constraints):
+                boots.update(design, _constraint_data([new_reps[kpi]],
+                                                      threshold, kind,
+                                                      method)[0])
+
+            spent += n_new
+
+    passed = np.ones(n_designs, dtype=bool)
+    for prop in props:
+        passed &= prop >= gamma
+
+    return designs[passed], replications, props
+
+
+def _constraint_data(data, threshold, kind, method):
+    """
+    Returns the values to bootstrap for a chance constraint.
+    The 'count' method bootstraps indicators of meeting the threshold.
+    """
+    if method.lower() == 'mean':
+        return data
+
+    if kind.lower() == 'lower':
+        return [(np.asarray(d) >= threshold).astype(np.float64) for d in data]
+
+    return [(np.asarray(d) <= threshold).astype(np.float64) for d in data]
+
+
+def _constraint_proportions(online, constraints, gamma, method):
+    """
+    Returns the decision proportions used to allocate replications and
+    the pass proportions compared with @gamma (constraints x systems)
+    """
+    decision = np.empty((len(constraints), online[0].weights.shape[0]))
+    props = np.empty_like(decision)
+
+    for i, (boots, (_, threshold, kind)) in enumerate(zip(online,
+                                                          constraints)):
+        means = boots.means()
+        if method.lower() == 'mean':
+            props[i] = pass_proportions(means, threshold, kind)
+            decision[i] = props[i]
+        else:
+            props[i] = means.mean(axis=1)
+            decision[i] = (means >= gamma).mean(axis=1)
+
+    return decision, props
+
+
+def _trim_to_budget(allocation, budget):
+    """
+    Reduce an allocation so that it does not exceed the remaining budget.
+    Replications are removed from the largest allocations first.
+    """
+    allocation = allocation.copy()
+    while allocation.sum() > budget:
+        allocation[np.argmax(allocation)] -= 1
+
+    return allocation
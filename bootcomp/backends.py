@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Alternative engines for bootstrapping the mean of k systems and
+automatic selection between them.
+
+Engines
+-------
+serial -- bootstrap.multi_bootstrap (numba, one core)
+parallel -- numba, systems split across cores (one parallel region
+            per call rather than one per system as in multi_bootstrap_par)
+numpy -- vectorised numpy indexing, no compilation
+matmul -- one multinomial weight matrix shared by all systems and a
+          matrix multiply.  Each system's bootstrap is still a valid
+          bootstrap of its mean, but resamples of different systems use
+          the same replication numbers (as with common random numbers).
+process -- systems split across a pool of worker processes
+
+select_backend chooses an engine from the problem shape and the number
+of cores.  calibrate() times the engines on this machine and stores the
+results so that later selections use measured crossover points.
+
+"""
+
+import atexit
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numba import jit, prange
+
+from bootcomp.bootstrap import _seed_numba, bootstrap, multi_bootstrap
+
+CALIBRATION_FILE = os.path.join(os.path.expanduser('~'), '.bootcomp',
+                                'backends.json')
+
+#maximum number of random indexes drawn at once by the numpy engine
+NUMPY_CHUNK = 2**22
+
+#rules used by select_backend when there is no calibration.
+#largest (boots x replications) weight matrix drawn by the matmul engine
+MATMUL_MAX_WEIGHTS = 2**24
+#resampled values (systems x replications x boots) before the parallel
+#and process engines are worth starting
+PARALLEL_MIN_WORK = 10**6
+PROCESS_MIN_WORK = 10**10
+
+_calibration = {}
+_process_pool = None
+_process_workers = None
+_process_lock = threading.Lock()
+
+
+@jit(nopython=True, nogil=True, parallel=True)
+def multi_bootstrap_prange(data, boots):
+    """
+    Bootstrap the mean of each system with systems split across cores.
+
+    Keyword arguments:
+    data -- numpy multi-dimentional array
+    boots -- number of bootstraps
+    """
+    #pylint: disable-msg=E1133
+    designs = data.shape[0]
+
+    to_return = np.empty((designs, boots))
+
+    for design in prange(designs):
+
+        to_return[design] = bootstrap(data[design], boots)
+
+    return to_return
+
+
+def multi_bootstrap_numpy(data, boots, rng=None):
+    """
+    Bootstrap the mean of each system using vectorised numpy indexing.
+    Systems are processed in chunks of at most NUMPY_CHUNK indexes.
+
+    Keyword arguments:
+    data -- numpy multi-dimentional array
+    boots -- number of bootstraps
+    rng -- numpy.random.RandomState (default = None i.e. numpy's
+           global state)
+    """
+    random = np.random if rng is None else rng
+    designs, n = data.shape
+    to_return = np.empty((designs, boots))
+    block = max(1, NUMPY_CHUNK // (boots * n))
+
+    for start in range(0, designs, block):
+        values = np.asarray(data[start:start + block])
+        index = random.randint(0, n, size=(values.shape[0], boots, n))
+        rows = np.arange(values.shape[0])[:, np.newaxis, np.newaxis]
+        to_return[start:start + block] = values[rows, index].mean(axis=2)
+
+    return to_return
+
+
+def multi_bootstrap_matmul(data, boots, rng=None):
+    """
+    Bootstrap the mean of each system as a matrix multiply of the data
+    with a (boots x replications) matrix of multinomial resample counts.
+
+    Keyword arguments:
+    data -- numpy multi-dimentional array
+    boots -- number of bootstraps
+    rng -- numpy.random.RandomState (default = None i.e. numpy's
+           global state)
+    """
+    random = np.random if rng is None else rng
+    n = data.shape[1]
+    weights = random.multinomial(n, np.full(n, 1.0 / n), size=boots)
+    return np.asarray(data) @ (weights.T / n)
+
+
+def _process_chunk(data, boots, seed):
+    _seed_numba(seed)
+    return multi_bootstrap(data, boots)
+
+
+def multi_bootstrap_process(data, boots, workers=None, rng=None):
+    """
+    Bootstrap the mean of each system with systems split across a pool
+    of worker processes.  The pool is created on first use and reused
+    (@workers only applies to the first call).
+
+    Keyword arguments:
+    data -- numpy multi-dimentional array
+    boots -- number of bootstraps
+    workers -- number of processes (default = None i.e. os.cpu_count())
+    rng -- numpy.random.RandomState used to seed the workers
+           (default = None i.e. numpy's global state)
+    """
+    pool, n_workers = _get_process_pool(workers)
+
+    chunks = np.array_split(np.arange(data.shape[0]), n_workers)
+    chunks = [chunk for chunk in chunks if chunk.shape[0] > 0]
+
+    #each worker needs its own random stream
+    random = np.random if rng is None else rng
+    seeds = random.randint(0, 2**31 - 1, size=len(chunks))
+    futures = [pool.submit(_process_chunk,
+                           np.asarray(data[chunk[0]:chunk[-1] + 1]),
+                           boots, int(seed))
+               for chunk, seed in zip(chunks, seeds)]
+
+    return np.concatenate([future.result() for future in futures])
+
+
+def _get_process_pool(workers):
+    """
+    Returns the shared process pool (created on first use) and its
+    number of worker processes
+    """
+    global _process_pool, _process_workers  #pylint: disable-msg=W0603
+
+    with _process_lock:
+        if _process_pool is None:
+            _process_workers = workers or os.cpu_count() or 1
+            #forking a process that has started numba threads is unsafe
+            _process_pool = ProcessPoolExecutor(
+                _process_workers,
+                mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(shutdown_process_pool)
+
+        return _process_pool, _process_workers
+
+
+def shutdown_process_pool():
+    """
+    Stop the worker processes used by multi_bootstrap_process
+    """
+    global _process_pool, _process_workers  #pylint: disable-msg=W0603
+
+    with _process_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown()
+            _process_pool = None
+            _process_workers = None
+
+
+#engines that draw from numpy rather than numba random streams
+NUMPY_RANDOM_BACKENDS = ['numpy', 'matmul', 'process']
+
+BACKENDS = {'serial': multi_bootstrap,
+            'parallel': multi_bootstrap_prange,
+            'numpy': multi_bootstrap_numpy,
+            'matmul': multi_bootstrap_matmul,
+            'process': multi_bootstrap_process}
+
+
+def select_backend(designs, reps, boots, cores=None, path=None):
+    """
+    Returns the name of the engine expected to be fastest for a problem.
+
+    If a calibration file exists and was made with @cores cores the
+    fastest engine at the nearest calibrated problem size is used.
+    Otherwise (or if no usable engine was calibrated) the engine is chosen
+    from the number of systems, the size of each system's resampling
+    problem (@reps x @boots) and @cores (see MATMUL_MAX_WEIGHTS,
+    PARALLEL_MIN_WORK and PROCESS_MIN_WORK).
+
+    Keyword arguments:
+    designs -- number of systems
+    reps -- number of replications of each system
+    boots -- number of bootstrap datasets
+    cores -- number of cores (default = None i.e. os.cpu_count())
+    path -- calibration file (default = None i.e. CALIBRATION_FILE)
+    """
+    if cores is None:
+        cores = os.cpu_count() or 1
+
+    calibration = load_calibration(path)
+    if calibration.get('measurements') and calibration.get('cores') == cores:
+        backend = _nearest_measurement(calibration['measurements'], designs,
+                                       reps, boots, cores)
+        if backend is not None:
+            return backend
+
+    work = designs * reps * boots
+
+    #drawing the weight matrix costs about as much as bootstrapping
+    #2-3 systems, after which the matrix multiply is far faster - as
+    #long as the (boots x replications) weight matrix fits in memory
+    if designs >= 4 and reps * boots <= MATMUL_MAX_WEIGHTS:
+        return 'matmul'
+
+    if cores > 1 and designs > 1:
+        #starting worker processes only pays off for very large problems
+        if work >= PROCESS_MIN_WORK and designs >= cores:
+            return 'process'
+
+        if work >= PARALLEL_MIN_WORK:
+            return 'parallel'
+
+    return 'serial'
+
+
+def multi_bootstrap_auto(data, boots, backend='auto', rng=None):
+    """
+    Bootstrap the mean of each system with the named engine or,
+    if @backend = 'auto', the engine chosen by select_backend.
+
+    Keyword arguments:
+    data -- numpy multi-dimentional array
+    boots -- number of bootstraps
+    backend -- 'auto' or a key of BACKENDS (default = 'auto')
+    rng -- numpy.random.RandomState for the engines in
+           NUMPY_RANDOM_BACKENDS (default = None i.e. numpy's global
+           state).  The numba engines use the calling thread's stream.
+    """
+    if backend == 'auto':
+        backend = select_backend(data.shape[0], data.shape[1], boots)
+
+    if backend not in BACKENDS:
+        msg = 'Parameter @backend must be auto or one of {0}'
+        raise ValueError(msg.format(sorted(BACKENDS)))
+
+    if backend in NUMPY_RANDOM_BACKENDS:
+        return BACKENDS[backend](data, boots, rng=rng)
+
+    return BACKENDS[backend](data, boots)
+
+
+def load_calibration(path=None):
+    """
+    Returns the stored calibration (an empty dict if there is none).
+    Files are read once per process.
+    """
+    if path is None:
+        path = CALIBRATION_FILE
+
+    if path not in _calibration:
+        if os.path.exists(path):
+            with open(path) as stored:
+                _calibration[path] = json.load(stored)
+        else:
+            _calibration[path] = {}
+
+    return _calibration[path]
+
+
+def calibrate(path=None, designs=(10, 100, 1000), reps=(5, 50),
+              boots=(1000,), backends=None, repeats=3):
+    """
+    Time each engine over a grid of problem sizes and store the results.
+
+    Returns the calibration dict that was written to @path.
+
+    Keyword arguments:
+    path -- calibration file (default = None i.e. CALIBRATION_FILE)
+    designs -- numbers of systems to time
+    reps -- numbers of replications to time
+    boots -- numbers of bootstrap datasets to time
+    backends -- engines to time (default = None i.e. all of BACKENDS)
+    repeats -- best of @repeats timings is kept (default = 3)
+    """
+    #pylint: disable-msg=R0913
+    if path is None:
+        path = CALIBRATION_FILE
+
+    if backends is None:
+        backends = list(BACKENDS)
+
+    measurements = []
+
+    for n_designs in designs:
+        for n_reps in reps:
+            for n_boots in boots:
+                data = np.random.rand(n_designs, n_reps)
+                times = {}
+
+                for name in backends:
+                    #first call compiles numba engines / starts the pool
+                    BACKENDS[name](data[:2], 2)
+                    times[name] = min(_time(BACKENDS[name], data, n_boots)
+                                      for _ in range(repeats))
+
+                measurements.append({'designs': n_designs, 'reps': n_reps,
+                                     'boots': n_boots, 'times': times,
+                                     'best': min(times, key=times.get)})
+
+    calibration = {'cores': os.cpu_count() or 1,
+                   'measurements': measurements}
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as stored:
+        json.dump(calibration, stored, indent=2)
+
+    _calibration[path] = calibration
+    return calibration
+
+
+def _time(engine, data, boots):
+    start = time.perf_counter()
+    engine(data, boots)
+    return time.perf_counter() - start
+
+
+def _nearest_measurement(measurements, designs, reps, boots, cores):
+    """
+    Fastest engine at the calibrated size nearest (in log space) to
+    the problem.  Multi-core engines are skipped on a single core.
+    None if no other engine was measured.
+    """
+    point = np.log([designs, reps, boots])
+
+    def distance(measurement):
+        other = np.log([measurement['designs'], measurement['reps'],
+                        measurement['boots']])
+        return np.abs(point - other).sum()
+
+    nearest = min(measurements, key=distance)
+    times = dict(nearest['times'])
+
+    if cores == 1:
+        times.pop('parallel', None)
+        times.pop('process', None)
+
+    if not times:
+        return None
+
+    return min(times, key=times.get)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Run the two stage procedure for many studies (e.g. wards or hospitals)
+at once.
+
+The replications of every system of every study are packed into one
+flat buffer (see bootcomp.ragged) with study offsets.  Each stage is
+then a single kernel launch over all studies rather than one call of
+constraints_bootstrap / quality_bootstrap per study.
+
+A study is a dict of numpy arrays (systems x replications) by KPI name.
+Studies may have different numbers of systems and replications.
+
+"""
+
+import numpy as np
+
+from bootcomp.bootstrap import (_multi_bootstrap, _random_state,
+                                paired_differences)
+from bootcomp.ragged import RaggedReplications, _offsets
+from bootcomp.ranking import lexicographic_order
+
+
+def pack_studies(studies):
+    """
+    Pack the studies into one RaggedReplications per KPI.
+
+    Returns a tuple of:
+    1. dict of RaggedReplications by KPI name (all systems of all studies)
+    2. numpy array (studies + 1) of the position of each study's first
+       system in the packed systems
+
+    Keyword arguments:
+    studies -- list of dicts of numpy arrays (systems x replications)
+    """
+    kpis = list(studies[0])
+    systems = np.array([len(study[kpis[0]]) for study in studies])
+    packed = {}
+
+    for kpi in kpis:
+        arrays = [np.asarray(system, dtype=np.float64)
+                  for study in studies for system in study[kpi]]
+        packed[kpi] = RaggedReplications.from_arrays(arrays)
+
+    return packed, _offsets(systems)
+
+
+VALID_CORES = ['single', 'parallel', 's', 'p']
+
+
+def batch_constraints(packed, study_offsets, constraints, gamma,
+                      nboots=1000, method='mean', seed=None, cores='s'):
+    """
+    Stage 1 chance constraints for every study in one kernel launch.
+
+    Returns a list (one per study) of numpy arrays of the positions of
+    the systems within the study that meet all constraints.
+
+    Keyword arguments:
+    packed -- dict of RaggedReplications by KPI (see pack_studies)
+    study_offsets -- study offsets (see pack_studies)
+    constraints -- list of (kpi, threshold, kind) tuples.  threshold is
+                   either a single value or one value per study.
+    gamma -- the probability cut off for the chance constraints
+    nboots -- the number of bootstrap datasets (default = 1000)
+    method -- 'mean' = as constraints_bootstrap; 'count' = as
+              constraints_bootstrap_r1 (default = 'mean')
+    seed -- random seed (default = None).  Results are only repeatable
+            with cores='s'.
+    cores -- single ('s') or parallel ('p') execution of the bootstrap
+             (default = 's')
+    """
+    #pylint: disable-msg=R0913,R0914
+
+    valid_operations = ['upper', 'lower']
+    valid_methods = ['mean', 'count']
+
+    for _, _, kind in constraints:
+        if kind.lower() not in valid_operations:
+            raise ValueError('Parameter @kind must be either set to lower or upper')
+
+    if method.lower() not in valid_methods:
+        raise ValueError('Parameter @method must be either set to mean or count')
+
+    _check_cores(cores)
+
+    n_systems = study_offsets[-1]
+    study_sizes = np.diff(study_offsets)
+
+    #every constraint of every system in one ragged array
+    arrays = []
+    for kpi, threshold, kind in constraints:
+        data = packed[kpi]
+        if method.lower() == 'count':
+            data = _indicators(data, np.repeat(_per_study(threshold,
+                                                          study_sizes),
+                                               study_sizes), kind)
+        arrays.append(data)
+
+    combined = RaggedReplications(
+        np.concatenate([data.values for data in arrays]),
+        _offsets(np.concatenate([data.lengths() for data in arrays])))
+
+    _random_state(seed)
+    boots = _multi_bootstrap(combined, nboots, cores.lower())
+
+    passed = np.ones(n_systems, dtype=bool)
+    for i, (_, threshold, kind) in enumerate(constraints):
+        kpi_boots = boots[i * n_systems:(i + 1) * n_systems]
+
+        if method.lower() == 'count':
+            prop = kpi_boots.mean(axis=1)
+        else:
+            limit = np.repeat(_per_study(threshold, study_sizes),
+                              study_sizes)[:, np.newaxis]
+            if kind.lower() == 'lower':
+                prop = (kpi_boots >= limit).mean(axis=1)
+            else:
+                prop = (kpi_boots <= limit).mean(axis=1)
+
+        passed &= prop >= gamma
+
+    return _split(np.flatnonzero(passed), study_offsets)
+
+
+def batch_best_systems(packed, study_offsets, feasible, labels):
+    """
+    Returns a list (one per study) of the position of the best feasible
+    system, ranking the means of @labels lexicographically as
+    get_best_subset does.  None if a study has no feasible systems.
+
+    Keyword arguments:
+    packed -- dict of RaggedReplications by KPI (see pack_studies)
+    study_offsets -- study offsets (see pack_studies)
+    feasible -- list (one per study) of feasible system positions
+    labels -- KPI names in ranking order
+    """
+    means = np.column_stack([packed[kpi].means() for kpi in labels])
+    best = []
+
+    for study, systems in enumerate(feasible):
+        if len(systems) == 0:
+            best.append(None)
+            continue
+
+        #sorted so ties do not depend on the order of @feasible
+        systems = np.unique(np.asarray(systems, dtype=np.int64))
+        study_means = means[study_offsets[study] + systems]
+        best.append(systems[lexicographic_order(study_means)[0]])
+
+    return best
+
+
+def batch_quality(data, study_offsets, feasible, best, alpha=0.95,
+                  beta=0.1, nboots=1000, seed=None, cores='s'):
+    """
+    Stage quality bootstrap for every study in one kernel launch.
+    Each feasible system is differenced from its study's best system
+    (paired by replication number) as in quality_bootstrap.
+
+    Returns a list (one per study) of numpy arrays of the positions of
+    the systems within the study that are within beta% of the best mean
+    in alpha% of bootstrap datasets.
+
+    Keyword arguments:
+    data -- RaggedReplications of the primary KPI (see pack_studies)
+    study_offsets -- study offsets (see pack_studies)
+    feasible -- list (one per study) of feasible system positions
+    best -- list (one per study) of the best system position (or None)
+    alpha -- % of bootstrap samples that must be within tolerance
+    beta -- % tolerance of difference from best mean allowed
+    nboots -- the number of bootstrap datasets (default = 1000)
+    seed -- random seed (default = None).  Results are only repeatable
+            with cores='s'.
+    cores -- single ('s') or parallel ('p') execution of the bootstrap
+             (default = 's')
+    """
+    #pylint: disable-msg=R0913,R0914
+    _check_cores(cores)
+    study_sizes = np.diff(study_offsets)
+    selected = []
+    reference = []
+
+    for study, systems in enumerate(feasible):
+        if best[study] is None:
+            continue
+
+        #positions may be given in any order; results are sorted
+        systems = np.unique(np.asarray(systems, dtype=np.int64))
+        if systems.shape[0] > 0 and (systems[0] < 0
+                                     or systems[-1] >= study_sizes[study]):
+            msg = 'Parameter @feasible must only contain positions of '
+            msg += 'systems within each study'
+            raise ValueError(msg)
+
+        if best[study] not in systems:
+            raise ValueError('Parameter @best must be a feasible system')
+
+        start = len(selected)
+        selected.extend(study_offsets[study] + systems)
+        best_at = start + int(np.searchsorted(systems, best[study]))
+        reference.extend([best_at] * systems.shape[0])
+
+    if len(selected) == 0:
+        return [np.array([], dtype=np.int64) for _ in feasible]
+
+    selected = np.asarray(selected, dtype=np.int64)
+    reference = np.asarray(reference, dtype=np.int64)
+    subset = data.take(selected)
+
+    diffs, diff_offsets = paired_differences(subset.values, subset.offsets,
+                                             reference)
+    _random_state(seed)
+    boots = _multi_bootstrap(RaggedReplications(diffs, diff_offsets), nboots,
+                             cores.lower())
+
+    indifference = subset.means()[reference] * beta
+    counts = (boots <= indifference[:, np.newaxis]).sum(axis=1)
+
+    return _split(selected[counts >= nboots * alpha], study_offsets)
+
+
+def batch_two_stage(studies, constraints, objective, gamma, alpha=0.95,
+                    beta=0.1, nboots=1000, method='mean', seed=None,
+                    cores='s'):
+    """
+    Apply the chance constraints and quality bootstrap to many studies.
+
+    Returns a list (one per study) of tuples of numpy arrays
+    (feasible systems, indifferent systems) of positions within the study.
+
+    Keyword arguments:
+    studies -- list of dicts of numpy arrays (systems x replications)
+    constraints -- list of (kpi, threshold, kind) tuples
+    objective -- name of the primary KPI (lower is better)
+    gamma -- the probability cut off for the chance constraints
+    alpha -- % of bootstrap samples that must be within tolerance
+    beta -- % tolerance of difference from best mean allowed
+    nboots -- the number of bootstrap datasets (default = 1000)
+    method -- 'mean' or 'count' chance constraints (default = 'mean')
+    seed -- random seed (default = None).  Results are only repeatable
+            with cores='s'.
+    cores -- single ('s') or parallel ('p') execution of the bootstrap
+             (default = 's')
+    """
+    #pylint: disable-msg=R0913
+    packed, study_offsets = pack_studies(studies)
+    feasible = batch_constraints(packed, study_offsets, constraints, gamma,
+                                 nboots, method, seed, cores)
+
+    labels = [objective] + [kpi for kpi in packed if kpi != objective]
+    best = batch_best_systems(packed, study_offsets, feasible, labels)
+    indifferent = batch_quality(packed[objective], study_offsets, feasible,
+                                best, alpha, beta, nboots, seed, cores)
+
+    return list(zip(feasible, indifferent))
+
+
+def _check_cores(cores):
+    if cores.lower() not in VALID_CORES:
+        msg = 'Parameter @cores must be either set to '
+        msg += 'single (default) or parrallel (or p)'
+        raise ValueError(msg)
+
+
+def _per_study(value, study_sizes):
+    value = np.asarray(value, dtype=np.float64)
+    if value.ndim == 0:
+        return np.full(study_sizes.shape[0], float(value))
+    return value
+
+
+def _indicators(data, thresholds, kind):
+    """
+    RaggedReplications of 1/0 indicators of each replication meeting
+    its system's threshold
+    """
+    limit = np.repeat(thresholds, data.lengths())
+    if kind.lower() == 'lower':
+        values = (data.values >= limit).astype(np.float64)
+    else:
+        values = (data.values <= limit).astype(np.float64)
+
+    return RaggedReplications(values, data.offsets)
+
+
+def _split(positions, study_offsets):
+    """
+    Split global system positions into sorted per study positions
+    """
+    positions = np.sort(positions)
+    bounds = np.searchsorted(positions, study_offsets)
+    return [positions[bounds[i]:bounds[i + 1]] - study_offsets[i]
+            for i in range(study_offsets.shape[0] - 1)]
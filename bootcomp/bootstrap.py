@@ -9,6 +9,11 @@ import numpy as np
 import pandas as pd
 from numba import jit, prange
 
+from bootcomp.ragged import RaggedReplications
+
+#bytes available to bootstrap a block of systems out of core
+DEFAULT_MEMORY_BUDGET = 256 * 2**20
+
 def bootstrap_np(data, boots=1000):
     """
     Alternative bootstrap routine that works exclusively with a numpy
@@ -42,8 +47,107 @@ def bootstrap_np(data, boots=1000):
 
 
 
+@jit(nopython=True)
+def _seed_numba(seed):
+    np.random.seed(seed)
+
+
+def set_seed(seed):
+    """
+    Seed both the numpy and the numba random number streams.
+    Numba compiled functions do not share numpy's random state.
+
+    Keyword arguments:
+    seed -- int or None.  None leaves the random state unchanged.
+    """
+    if seed is None:
+        return
+
+    np.random.seed(seed)
+    _seed_numba(seed)
+
+
+def _random_state(seed):
+    """
+    Seed the calling thread's numba random stream and return a
+    numpy.random.RandomState for the engines that do not use numba
+    (see bootcomp.backends).  Unlike set_seed the process wide numpy
+    state is left alone so concurrent seeded calls (see bootcomp.threads)
+    do not interfere with each other.
+
+    Returns None if @seed is None.
+    """
+    if seed is None:
+        return None
+
+    _seed_numba(seed)
+    return np.random.RandomState(seed)
+
+
+def _cache_lookup(cache, seed, name, data, **params):
+    """
+    Returns the cache key and cached entry (or None) of a bootstrap call.
+    Unseeded calls are not cached.
+    """
+    if cache is None or seed is None:
+        return None, None
+
+    if isinstance(data, RaggedReplications):
+        data = (data.values, data.offsets)
+
+    key = cache.key(name, data, seed=seed, **params)
+    return key, cache.get(key)
+
+
+def _seed_reproducible(data, boots, cores, statistic='mean',
+                       memory_budget=None, blocked=None):
+    """
+    True if a seeded bootstrap of @data (systems x replications or
+    RaggedReplications) with @cores always gives the same result, so it
+    can be cached.  prange worker threads keep their own unseeded numba
+    streams, so the parallel engines (cores='p', and cores='auto' when
+    it chooses 'parallel' for a block of systems) are not repeatable.
+    Statistics other than the mean always run on a single core.
+    @blocked is True if @data is bootstrapped in blocks sized to
+    @memory_budget (default = None i.e. as constraints_bootstrap).
+    """
+    cores = cores.lower()
+
+    if statistic != 'mean' or cores in ('single', 's'):
+        return True
+
+    if cores in ('parallel', 'p'):
+        return False
+
+    if isinstance(data, RaggedReplications):
+        #cores='auto' bootstraps ragged data on a single core
+        return True
+
+    #imported here as bootcomp.backends builds on this module
+    from bootcomp.backends import select_backend
+
+    designs, reps = data.shape
+    sizes = [designs]
+    if blocked is None:
+        blocked = _out_of_core(data, memory_budget)
+
+    if blocked:
+        block = design_block_size(reps, boots, memory_budget)
+        sizes = {min(block, designs), designs % block or block}
+
+    return all(select_backend(size, reps, boots) != 'parallel'
+               for size in sizes)
+
+
+def _cache_store(cache, key, entry):
+    if key is not None:
+        cache.put(key, entry)
+
+
 def constraints_bootstrap(data, threshold, nboots=1000,
-                          gamma=0.95, kind='lower', cores='single'):
+                          gamma=0.95, kind='lower', cores='single',
+                          seed=None, cache=None, memory_budget=None,
+                          statistic='mean', q=0.9):
     """
     Bootstrap a chance constraint for k systems and filter out systems
     where p% of resamples are greater a threshold t.
@@ -60,39 +164,77 @@ def constraints_bootstrap(data, threshold, nboots=1000,
     i.e. that do not violate the chance constraint.
 
     Keyword arguments:
-    data -- a numpy array of the data to bootstrap
+    data -- a numpy array of the data to bootstrap (systems x replications)
+            or a bootcomp.ragged.RaggedReplications
     threshold -- the threshold of the chance constraint
     n_boots -- the number of bootstrap datasets to generate (default = 1000)
     gamma -- the probability cut off for the chance constraint (default p = 0.95)
     kind -- 'lower' = a lower limit threshold; 'upper' = an upper
              limit threshold (default = 'lower')
     cores - single ('single' or 's') core or parallel ('p' or 'parallel')
-            execution. (default = 's')
+            execution or 'auto' to choose the fastest engine for the
+            problem size (see bootcomp.backends). (default = 's')
+    seed -- random seed for the bootstrap (default = None)
+    cache -- optional bootcomp.cache.BootstrapCache.  Only used when
+             @seed is set and the engine is repeatable (not 'p', or an
+             'auto' choice of 'parallel').  Pass counts do not depend
+             on @gamma so a cached result is reused when only @gamma
+             changes.
+    memory_budget -- bytes available for bootstrapping a block of systems.
+             If set, or @data is a numpy.memmap, systems are bootstrapped
+             in blocks and only pass counts are kept (default = None)
+    statistic -- statistic compared with the threshold: 'mean' (default),
+             'variance', 'quantile' (e.g. the 90th percentile of waiting
+             time) or 'cvar' (mean of the values above the q quantile)
+    q -- probability used by the quantile and cvar statistics
+             (default = 0.9)
     """
     #pylint: disable-msg=R0913
 
     valid_operations = ['upper', 'lower']
-    valid_cores = ['single', 'parallel', 's', 'p']
+    valid_cores = ['single', 'parallel', 's', 'p', 'auto']
 
     if kind.lower() not in valid_operations:
         raise ValueError('Parameter @kind must be either set to lower or upper')
 
     if cores.lower() not in valid_cores:
         msg = 'Parameter @cores must be either set to '
-        msg += 'single (default) or parrallel (or p)'
+        msg += 'single (default), parrallel (or p) or auto'
         raise ValueError(msg)
 
-    if cores in ('single', 's'):
-        df_boots = pd.DataFrame(multi_bootstrap(data, nboots).T)
-    else:
-        df_boots = pd.DataFrame(multi_bootstrap_par(data, nboots).T)
+    _check_statistic(statistic, q)
 
-    if kind.lower() == 'lower':
-        df_counts = pd.DataFrame(df_boots[df_boots >= threshold].count(),
-                                 columns={'count'})
-    else:
-        df_counts = pd.DataFrame(df_boots[df_boots <= threshold].count(),
-                                 columns={'count'})
+    if not _seed_reproducible(data, nboots, cores, statistic, memory_budget):
+        cache = None
+
+    key, entry = _cache_lookup(cache, seed, 'constraints_bootstrap', data,
+                               threshold=threshold, nboots=nboots,
+                               kind=kind.lower(), cores=cores.lower(),
+                               statistic=statistic, q=q)
+
+    if entry is None and _out_of_core(data, memory_budget):
+        rng = _random_state(seed)
+        counts = np.empty(data.shape[0], dtype=np.int64)
+
+        for start, stop, boots in iter_bootstrap_blocks(data, nboots,
+                                                        memory_budget,
+                                                        cores,
+                                                        statistic=statistic,
+                                                        q=q, rng=rng):
+            counts[start:stop] = _count_passes(boots, threshold, kind)
+
+        entry = {'count': counts}
+        _cache_store(cache, key, entry)
+
+    if entry is None:
+        rng = _random_state(seed)
+        boots = _multi_bootstrap(data, nboots, cores, statistic, q, rng)
+
+        entry = {'count': _count_passes(boots, threshold, kind),
+                 'resamples': boots}
+        _cache_store(cache, key, entry)
+
+    df_counts = pd.DataFrame(entry['count'], columns=['count'])
 
     df_counts['prop'] = df_counts['count'] / nboots
     df_counts['pass'] = np.where(df_counts['prop'] >= gamma, 1, 0)
@@ -101,7 +243,9 @@ def constraints_bootstrap(data, threshold, nboots=1000,
 
 
 def constraints_bootstrap_r1(data, threshold, nboots=1000,
-                             gamma=0.95, kind='lower', cores='single'):
+                             gamma=0.95, kind='lower', cores='single',
+                             seed=None, cache=None, memory_budget=None,
+                             boots_file='df_boots.csv'):
     """
     Bootstrap a chance constraint for k systems and filter out systems
     where p% of resamples are greater a threshold t.
@@ -118,7 +262,8 @@ def constraints_bootstrap_r1(data, threshold, nboots=1000,
     i.e. that do not violate the chance constraint.
 
     Keyword arguments:
-    data -- a numpy array of the data to bootstrap
+    data -- a numpy array of the data to bootstrap (systems x replications)
+            or a bootcomp.ragged.RaggedReplications
     threshold -- the threshold of the chance constraint
     n_boots -- the number of bootstrap datasets to generate (default = 1000)
     gamma -- the probability cut off for the chance constraint (default p = 0.95)
@@ -126,6 +271,15 @@ def constraints_bootstrap_r1(data, threshold, nboots=1000,
              limit threshold (default = 'lower')
     cores - single ('single' or 's') core or parallel ('p' or 'parallel')
             execution. (default = 's')
+    seed -- random seed for the bootstrap (default = None)
+    cache -- optional bootcomp.cache.BootstrapCache.  Only used when
+             @seed is set.
+    memory_budget -- bytes available for bootstrapping a block of systems.
+             If set, or @data is a numpy.memmap, systems are bootstrapped
+             in blocks, only counts are kept and @boots_file is not
+             written (default = None)
+    boots_file -- file the bootstrap datasets are written to
+             (default = 'df_boots.csv').  None = do not write.
     """
     #pylint: disable-msg=R0913
 
@@ -140,21 +294,57 @@ def constraints_bootstrap_r1(data, threshold, nboots=1000,
         msg += 'single (default) or parrallel (or p)'
         raise ValueError(msg)
 
+    if isinstance(data, RaggedReplications):
+        n = data.lengths()
+    else:
+        n = data[0].shape[0]
+
+    key, entry = _cache_lookup(cache, seed, 'constraints_bootstrap_r1', data,
+                               threshold=threshold, nboots=nboots,
+                               kind=kind.lower())
+
+    if entry is not None and boots_file is not None:
+        if 'resamples' in entry:
+            pd.DataFrame(entry['resamples'].T).to_csv(boots_file)
+        else:
+            #only counts were cached; resample again to write the file
+            entry = None
+
     if kind.lower() == 'lower':
         kind = 1
     else:
         kind = 0
 
-    n = data[0].shape[0]
+    if entry is None and _out_of_core(data, memory_budget):
+        _random_state(seed)
+        counts = np.empty(data.shape[0])
 
-    df_boots = pd.DataFrame(multi_bootstrap_constraint(data, 
-                                                        nboots,
-                                                        threshold,
-                                                        kind).T)
-    
-    df_boots.to_csv('df_boots.csv')
+        for start, stop, boots in iter_bootstrap_blocks(data, nboots,
+                                                        memory_budget,
+                                                        threshold=threshold,
+                                                        kind=kind):
+            counts[start:stop] = boots.sum(axis=1)
+
+        entry = {'count': counts}
+        _cache_store(cache, key, entry)
 
-    df_counts = pd.DataFrame(df_boots.sum(axis=0),columns={'count'})
+    if entry is None:
+        _random_state(seed)
+
+        if isinstance(data, RaggedReplications):
+            boots = multi_bootstrap_constraint_ragged(data.values,
+                                                      data.offsets, nboots,
+                                                      threshold, kind)
+        else:
+            boots = multi_bootstrap_constraint(data, nboots, threshold, kind)
+
+        if boots_file is not None:
+            pd.DataFrame(boots.T).to_csv(boots_file)
+
+        entry = {'count': boots.sum(axis=1), 'resamples': boots}
+        _cache_store(cache, key, entry)
+
+    df_counts = pd.DataFrame(entry['count'], columns=['count'])
    
     df_counts['prop'] = df_counts['count'] / (nboots * n)
     df_counts['pass'] = np.where(df_counts['prop'] >= gamma, 1, 0)
@@ -162,7 +352,145 @@ def constraints_bootstrap_r1(data, threshold, nboots=1000,
     return df_counts.loc[df_counts['pass'] == 1].index
 
 
-@jit(nopython=False)
+def _count_passes(boots, threshold, kind):
+    """
+    Returns the number of bootstrap means of each system that meet
+    a lower or upper threshold
+    """
+    if kind.lower() == 'lower':
+        return (boots >= threshold).sum(axis=1)
+
+    return (boots <= threshold).sum(axis=1)
+
+
+def _out_of_core(data, memory_budget):
+    if isinstance(data, RaggedReplications):
+        return False
+
+    return memory_budget is not None or isinstance(data, np.memmap)
+
+
+def _multi_bootstrap(data, boots, cores, statistic='mean', q=0.9, rng=None):
+    """
+    Bootstrap a statistic of a numpy array (systems x replications)
+    or RaggedReplications.  Statistics other than the mean run on a
+    single core.  @rng (numpy.random.RandomState) is used by the
+    engines chosen by cores='auto' that do not use numba.
+    """
+    if statistic != 'mean':
+        if isinstance(data, RaggedReplications):
+            return multi_bootstrap_statistic_ragged(data.values, data.offsets,
+                                                    boots,
+                                                    STATISTICS[statistic], q)
+        return multi_bootstrap_statistic(data, boots, STATISTICS[statistic], q)
+
+    if isinstance(data, RaggedReplications):
+        if cores in ('single', 's', 'auto'):
+            return multi_bootstrap_ragged(data.values, data.offsets, boots)
+        return multi_bootstrap_ragged_par(data.values, data.offsets, boots)
+
+    if cores == 'auto':
+        #imported here as bootcomp.backends builds on this module
+        from bootcomp.backends import multi_bootstrap_auto
+        return multi_bootstrap_auto(data, boots, rng=rng)
+
+    if cores in ('single', 's'):
+        return multi_bootstrap(data, boots)
+
+    return multi_bootstrap_par(data, boots)
+
+
+def design_block_size(n_reps, boots, memory_budget=None):
+    """
+    Returns the number of systems to bootstrap at once so that a block
+    of replications (and a working copy) plus its bootstrap datasets fit
+    within @memory_budget bytes.
+
+    Keyword arguments:
+    n_reps -- number of replications of each system
+    boots -- number of bootstrap datasets
+    memory_budget -- bytes (default = None i.e. DEFAULT_MEMORY_BUDGET)
+    """
+    if memory_budget is None:
+        memory_budget = DEFAULT_MEMORY_BUDGET
+
+    per_design = 8 * (2 * n_reps + boots)
+    return max(1, int(memory_budget // per_design))
+
+
+def iter_bootstrap_blocks(data, boots, memory_budget=None, cores='s',
+                          threshold=None, kind=None, offset=None,
+                          statistic='mean', q=0.9, rng=None):
+    """
+    Bootstrap blocks of systems sized to a memory budget.  If @data is a
+    numpy.memmap only the current block is read from disk.
+
+    Yields tuples of (start, stop, numpy array (systems x boots)) where
+    start and stop are the positions of the block's systems in @data.
+
+    Keyword arguments:
+    data -- numpy array or numpy.memmap (systems x replications)
+    boots -- number of bootstrap datasets
+    memory_budget -- bytes (default = None i.e. DEFAULT_MEMORY_BUDGET)
+    cores -- single or parallel execution of the mean bootstrap
+             (default = 's')
+    threshold -- threshold for the count bootstrap (see @kind)
+    kind -- None = bootstrap the mean; 1 (lower) or 0 (upper) =
+            bootstrap the count of replications meeting @threshold
+            (see multi_bootstrap_constraint)
+    offset -- optional numpy array (replications) subtracted from every
+              system before bootstrapping
+    statistic -- statistic to bootstrap when @kind is None
+                 (default = 'mean', see STATISTICS)
+    q -- probability used by the quantile and cvar statistics
+    rng -- numpy.random.RandomState for engines chosen by cores='auto'
+           (default = None i.e. numpy's global state)
+    """
+    #pylint: disable-msg=R0913
+    block = design_block_size(data.shape[1], boots, memory_budget)
+
+    for start in range(0, data.shape[0], block):
+        stop = min(start + block, data.shape[0])
+        values = data[start:stop]
+
+        if offset is not None:
+            values = values - offset
+
+        if kind is not None:
+            result = multi_bootstrap_constraint(values, boots, threshold, kind)
+        else:
+            result = _multi_bootstrap(values, boots, cores, statistic, q, rng)
+
+        yield start, stop, result
+
+
+def multi_bootstrap_blocked(data, boots, out=None, memory_budget=None,
+                            cores='s'):
+    """
+    Bootstrap the mean of every system block by block, writing the
+    bootstrap datasets to @out.  Pass a numpy.memmap as @out to stream
+    results to disk.
+
+    Returns @out (systems x boots)
+
+    Keyword arguments:
+    data -- numpy array or numpy.memmap (systems x replications)
+    boots -- number of bootstrap datasets
+    out -- array to write to (default = None i.e. a new numpy array)
+    memory_budget -- bytes (default = None i.e. DEFAULT_MEMORY_BUDGET)
+    cores -- single or parallel execution (default = 's')
+    """
+    if out is None:
+        out = np.empty((data.shape[0], boots))
+
+    for start, stop, result in iter_bootstrap_blocks(data, boots,
+                                                     memory_budget, cores):
+        out[start:stop] = result
+
+    return out
+
+
+@jit(nopython=True, nogil=True)
 def multi_bootstrap_constraint(data, boots, threshold, kind):
     """
     Keyword arguments:
@@ -191,7 +519,7 @@ def multi_bootstrap_constraint(data, boots, threshold, kind):
 
 
 
-@jit(nopython=False)
+@jit(nopython=True, nogil=True)
 def multi_bootstrap(data, boots):
     """
     Keyword arguments:
@@ -210,7 +538,7 @@ def multi_bootstrap(data, boots):
     return to_return
 
 
-@jit(nopython=False)
+@jit(nopython=True, nogil=True)
 def multi_bootstrap_par(data, boots):
     """
     Keyword arguments:
@@ -229,7 +557,113 @@ def multi_bootstrap_par(data, boots):
     return to_return
 
 
-@jit(nopython=True, parallel=True)
+@jit(nopython=True, nogil=True)
+def multi_bootstrap_ragged(values, offsets, boots):
+    """
+    Bootstrap the mean of systems with unequal numbers of replications.
+    Each system is resampled from its own replications.  Systems without
+    replications return NaN.
+
+    Keyword arguments:
+    values -- numpy array of every replication (see RaggedReplications)
+    offsets -- numpy array of the start of each system in @values
+    boots -- number of bootstraps
+    """
+    designs = offsets.shape[0] - 1
+
+    to_return = np.full((designs, boots), np.nan)
+
+    for design in range(designs):
+
+        if offsets[design + 1] > offsets[design]:
+            to_return[design] = bootstrap(values[offsets[design]:
+                                                 offsets[design + 1]], boots)
+
+    return to_return
+
+
+@jit(nopython=True, nogil=True)
+def multi_bootstrap_ragged_par(values, offsets, boots):
+    """
+    As multi_bootstrap_ragged using bootstrap_par
+    """
+    designs = offsets.shape[0] - 1
+
+    to_return = np.full((designs, boots), np.nan)
+
+    for design in range(designs):
+
+        if offsets[design + 1] > offsets[design]:
+            to_return[design] = bootstrap_par(values[offsets[design]:
+                                                     offsets[design + 1]],
+                                              boots)
+
+    return to_return
+
+
+@jit(nopython=True, nogil=True)
+def multi_bootstrap_constraint_ragged(values, offsets, boots, threshold, kind):
+    """
+    As multi_bootstrap_constraint for systems with unequal numbers of
+    replications (see multi_bootstrap_ragged)
+    """
+    designs = offsets.shape[0] - 1
+
+    to_return = np.zeros((designs, boots))
+
+    for design in range(designs):
+
+        to_return[design] = bootstrap_constraint(values[offsets[design]:
+                                                        offsets[design + 1]],
+                                                 boots, threshold, kind)
+
+    return to_return
+
+
+@jit(nopython=True, nogil=True)
+def ragged_differences(values, offsets, best):
+    """
+    Differences of each system from the system at position @best.
+    Replications are paired by replication number (common random
+    numbers) so each system keeps min(n_system, n_best) replications.
+
+    Returns a tuple of the values and offsets of the differences
+    """
+    designs = offsets.shape[0] - 1
+    return paired_differences(values, offsets,
+                              np.full(designs, best, dtype=np.int64))
+
+
+@jit(nopython=True, nogil=True)
+def paired_differences(values, offsets, reference):
+    """
+    As ragged_differences where each system has its own reference system.
+
+    Keyword arguments:
+    values -- numpy array of every replication (see RaggedReplications)
+    offsets -- numpy array of the start of each system in @values
+    reference -- numpy array of the position of each system's reference
+    """
+    designs = offsets.shape[0] - 1
+    lengths = np.minimum(offsets[1:] - offsets[:-1],
+                         offsets[reference + 1] - offsets[reference])
+
+    diff_offsets = np.zeros(designs + 1, dtype=np.int64)
+    diff_offsets[1:] = np.cumsum(lengths)
+    diffs = np.empty(diff_offsets[-1])
+
+    for design in range(designs):
+
+        best = reference[design]
+
+        for rep in range(lengths[design]):
+            diffs[diff_offsets[design] + rep] = (values[offsets[design] + rep]
+                                                 - values[offsets[best] + rep])
+
+    return diffs, diff_offsets
+
+
+@jit(nopython=True, nogil=True, parallel=True)
 def bootstrap_par(data, boots):
     """
     Create bootstrap datasets that represent the distribution of the mean.
@@ -256,7 +690,7 @@ def bootstrap_par(data, boots):
     return bs_data
 
 
-@jit(nopython=True)
+@jit(nopython=True, nogil=True)
 def bootstrap(data, boots):
     """
     Create bootstrap datasets that represent the distribution of the mean.
@@ -289,7 +723,7 @@ def bootstrap(data, boots):
 
 
 
-@jit(nopython=True)
+@jit(nopython=True, nogil=True)
 def bootstrap_constraint(data, boots, threshold, kind):
     """
     Create bootstrap datasets that represent the count of replications
@@ -351,6 +785,197 @@ def bootstrap_constraint(data, boots, threshold, kind):
 
 
 
+#statistics that can be bootstrapped (see bootstrap_statistic)
+STATISTICS = {'mean': 0, 'variance': 1, 'quantile': 2, 'cvar': 3}
+
+
+@jit(nopython=True, nogil=True)
+def resample_counts(counts):
+    """
+    Draw one bootstrap resample as the number of times each replication
+    is selected.  @counts is overwritten.
+    """
+    n = counts.shape[0]
+    counts[:] = 0
+
+    for sample in range(n):
+        counts[np.random.randint(0, n)] += 1
+
+
+@jit(nopython=True, nogil=True)
+def weighted_statistic(data, order, counts, stat, q):
+    """
+    A statistic of a resample described by the count of each replication.
+    Replications are visited in sorted order so quantiles and tail means
+    are found in O(n) without sorting the resample.
+
+    Keyword arguments:
+    data -- numpy array of replications
+    order -- numpy array that sorts @data (np.argsort(data))
+    counts -- numpy array of the count of each replication in the resample
+    stat -- 0 = mean; 1 = variance; 2 = quantile; 3 = cvar (see STATISTICS)
+    q -- probability of the quantile.  For cvar the mean of the values
+         above the q quantile (the upper 1 - q tail).
+    """
+    n = counts.sum()
+
+    if stat <= 1:
+        total = 0.0
+        for rep in range(data.shape[0]):
+            total += counts[rep] * data[rep]
+        mean = total / n
+
+        if stat == 0:
+            return mean
+
+        if n < 2:
+            return np.nan
+
+        total = 0.0
+        for rep in range(data.shape[0]):
+            total += counts[rep] * (data[rep] - mean) ** 2
+        return total / (n - 1)
+
+    if stat == 2:
+        #inverted cdf: smallest value with at least q of the resample below
+        target = max(1, int(np.ceil(q * n - 1e-9)))
+        cumulative = 0
+        for rep in order:
+            cumulative += counts[rep]
+            if cumulative >= target:
+                return data[rep]
+        return data[order[-1]]
+
+    tail = max(1, n - int(np.floor(q * n + 1e-9)))
+    taken = 0
+    total = 0.0
+    for i in range(order.shape[0] - 1, -1, -1):
+        rep = order[i]
+        take = min(counts[rep], tail - taken)
+        total += take * data[rep]
+        taken += take
+        if taken == tail:
+            break
+
+    return total / tail
+
+
+@jit(nopython=True, nogil=True)
+def bootstrap_statistic(data, boots, stat, q):
+    """
+    Create bootstrap datasets that represent the distribution of a
+    statistic (see weighted_statistic).  The replications are sorted once
+    and each resample is drawn as counts rather than values.
+
+    Keyword arguments:
+    data -- numpy array of replications of one system
+    boots -- number of bootstraps
+    stat -- code of the statistic (see STATISTICS)
+    q -- probability used by the quantile and cvar statistics
+    """
+    order = np.argsort(data)
+    counts = np.zeros(data.shape[0], dtype=np.int64)
+    bs_data = np.empty(boots)
+
+    for boot in range(boots):
+
+        resample_counts(counts)
+        bs_data[boot] = weighted_statistic(data, order, counts, stat, q)
+
+    return bs_data
+
+
+@jit(nopython=True, nogil=True)
+def multi_bootstrap_statistic(data, boots, stat, q):
+    """
+    As multi_bootstrap for any statistic (see bootstrap_statistic)
+    """
+    designs = data.shape[0]
+
+    to_return = np.empty((designs, boots))
+
+    for design in range(designs):
+
+        to_return[design] = bootstrap_statistic(data[design], boots, stat, q)
+
+    return to_return
+
+
+@jit(nopython=True, nogil=True)
+def multi_bootstrap_statistic_ragged(values, offsets, boots, stat, q):
+    """
+    As multi_bootstrap_ragged for any statistic (see bootstrap_statistic)
+    """
+    designs = offsets.shape[0] - 1
+
+    to_return = np.full((designs, boots), np.nan)
+
+    for design in range(designs):
+
+        if offsets[design + 1] > offsets[design]:
+            to_return[design] = bootstrap_statistic(values[offsets[design]:
+                                                           offsets[design + 1]],
+                                                    boots, stat, q)
+
+    return to_return
+
+
+@jit(nopython=True, nogil=True)
+def multi_bootstrap_statistic_paired(data, boots, stat, q):
+    """
+    Bootstrap a statistic of every system using the same resample of
+    replication numbers for all systems (common random numbers).
+    One set of counts is drawn per bootstrap regardless of the number
+    of systems, so blocks of systems bootstrapped from the same seed
+    are paired with each other.
+    """
+    designs = data.shape[0]
+    n = data.shape[1]
+
+    order = np.empty((designs, n), dtype=np.int64)
+    for design in range(designs):
+        order[design] = np.argsort(data[design])
+
+    counts = np.zeros(n, dtype=np.int64)
+    to_return = np.empty((designs, boots))
+
+    for boot in range(boots):
+
+        resample_counts(counts)
+
+        for design in range(designs):
+            to_return[design, boot] = weighted_statistic(data[design],
+                                                         order[design],
+                                                         counts, stat, q)
+
+    return to_return
+
+
+def sample_statistic(data, statistic='mean', q=0.9):
+    """
+    Returns a statistic of the original replications (see
+    weighted_statistic)
+
+    Keyword arguments:
+    data -- numpy array of replications of one system
+    statistic -- 'mean', 'variance', 'quantile' or 'cvar'
+    q -- probability used by the quantile and cvar statistics
+    """
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    return weighted_statistic(data, np.argsort(data),
+                              np.ones(data.shape[0], dtype=np.int64),
+                              STATISTICS[statistic], q)
+
+
+def _check_statistic(statistic, q):
+    if statistic not in STATISTICS:
+        msg = 'Parameter @statistic must be one of {0}'
+        raise ValueError(msg.format(sorted(STATISTICS)))
+
+    if not 0 < q < 1:
+        raise ValueError('Parameter @q must be between 0 and 1')
+
+
 def indifferent(x, indifference):
     """
     convert numbers to 0 or 1
@@ -364,7 +989,9 @@ def indifferent(x, indifference):
 
 
 def quality_bootstrap(feasible_systems, headers, best_system_index,
-                      alpha=0.95, beta=0.1, nboots=1000, cores='s'):
+                      alpha=0.95, beta=0.1, nboots=1000, cores='s',
+                      seed=None, cache=None, memory_budget=None,
+                      statistic='mean', q=0.9):
     """
     1. Create differences of systems from best system
     2. Create nboots bootstrap datasets of the differences
@@ -373,7 +1000,10 @@ def quality_bootstrap(feasible_systems, headers, best_system_index,
 
     Keyword arguments:
     feasible_systems -- systems that meet chance constraints
-                        (if there are any)
+                        (if there are any).  Either a DataFrame
+                        (replications x systems), a numpy array /
+                        numpy.memmap (systems x replications) that is
+                        bootstrapped out of core or a RaggedReplications.
 
     headers -- list of system indexes that are feasible
 
@@ -387,16 +1017,107 @@ def quality_bootstrap(feasible_systems, headers, best_system_index,
     nboots = number of bootstrap datasets to create (default = 1000)
 
     cores - single ('single' or 's') core or parallel ('p' or 'parallel')
-            execution. (default = 's')
+            execution or 'auto' to choose the fastest engine for the
+            problem size (see bootcomp.backends). (default = 's')
+
+    seed -- random seed for the bootstrap (default = None)
+
+    cache -- optional bootcomp.cache.BootstrapCache.  Only used when
+             @seed is set and the engine is repeatable (not 'p', or an
+             'auto' choice of 'parallel').  Counts within @beta are
+             cached so a cached result is reused when only @alpha
+             changes.
+
+    memory_budget -- bytes available for bootstrapping a block of systems
+             when @feasible_systems is a numpy array (default = None)
+
+    statistic -- statistic compared with the best system: 'mean' (default),
+             'variance', 'quantile' or 'cvar'.  For statistics other than
+             the mean every system is resampled with the same replication
+             numbers (common random numbers) and the differences of the
+             resampled statistics are compared with beta% of the best
+             system's statistic.  Not available for RaggedReplications.
+
+    q -- probability used by the quantile and cvar statistics
+             (default = 0.9)
     """
     #pylint: disable-msg=R0913
 
-    valid_cores = ['single', 'parallel', 's', 'p']
-    msg = 'Parameter @cores must be either set to single or parrallel'
+    valid_cores = ['single', 'parallel', 's', 'p', 'auto']
+    msg = 'Parameter @cores must be either set to single, parrallel or auto'
 
     if cores.lower() not in valid_cores:
         raise ValueError(msg)
 
+    _check_statistic(statistic, q)
+
+    ragged = isinstance(feasible_systems, RaggedReplications)
+    out_of_core = isinstance(feasible_systems, np.ndarray)
+
+    if ragged and statistic != 'mean':
+        raise ValueError('Parameter @statistic must be mean for RaggedReplications')
+
+    if ragged or out_of_core:
+        data = feasible_systems
+    else:
+        data = feasible_systems.values.T
+
+    if not _seed_reproducible(data, nboots, cores, statistic, memory_budget,
+                              out_of_core):
+        cache = None
+
+    if ragged or out_of_core:
+        key, entry = _cache_lookup(cache, seed, 'quality_bootstrap_array',
+                                   feasible_systems, headers=list(headers),
+                                   best_system_index=best_system_index,
+                                   beta=beta, nboots=nboots,
+                                   cores=cores.lower(), statistic=statistic,
+                                   q=q)
+    else:
+        key, entry = _cache_lookup(cache, seed, 'quality_bootstrap',
+                                   feasible_systems.values,
+                                   headers=list(headers),
+                                   best_system_index=best_system_index,
+                                   beta=beta, nboots=nboots,
+                                   cores=cores.lower(), statistic=statistic,
+                                   q=q)
+
+    if entry is None and statistic != 'mean':
+        rng = _random_state(seed)
+        counts = _quality_counts_statistic(data,
+                                           list(headers).index(best_system_index),
+                                           beta, nboots, statistic, q,
+                                           memory_budget, rng)
+        entry = {'count': counts}
+        _cache_store(cache, key, entry)
+
+    if entry is None and out_of_core:
+        rng = _random_state(seed)
+        counts = _quality_counts_blocked(feasible_systems, headers,
+                                         best_system_index, beta, nboots,
+                                         cores, memory_budget, rng)
+        entry = {'count': counts}
+        _cache_store(cache, key, entry)
+
+    if entry is None and ragged:
+        rng = _random_state(seed)
+        best = list(headers).index(best_system_index)
+        diffs = RaggedReplications(*ragged_differences(
+            feasible_systems.values, feasible_systems.offsets, best))
+        boots = _multi_bootstrap(diffs, nboots, cores, rng=rng)
+        indifference = feasible_systems[best].mean() * beta
+        entry = {'count': (boots <= indifference).sum(axis=1),
+                 'resamples': boots}
+        _cache_store(cache, key, entry)
+
+    if entry is not None:
+        df_within_limit = pd.DataFrame(entry['count'], index=headers,
+                                       columns=['sum'])
+        return indexes_meeting_quality_criteria(alpha, nboots,
+                                                df_within_limit)
+
+    rng = _random_state(seed)
+
     #setup differences
     diffs = pd.DataFrame(feasible_systems.values.T -
                          np.array(feasible_systems[best_system_index])).T
@@ -404,15 +1125,71 @@ def quality_bootstrap(feasible_systems, headers, best_system_index,
 
     #create bootstrap datasets
 
-    if cores in ('single', 's'):
-        df = pd.DataFrame(multi_bootstrap(diffs.values.T, nboots).T)
-    else:
-        df = pd.DataFrame(multi_bootstrap_par(diffs.values.T, nboots).T)
+    boots = _multi_bootstrap(diffs.values.T, nboots, cores, rng=rng)
 
+    df = pd.DataFrame(boots.T)
     df.columns = headers
 
     #find systems that have alpha% of bootstrap samples within x% of the best mean
-    return within_x(df, beta, alpha, feasible_systems, best_system_index, nboots)
+    df_indifference = indifference_dataframe(beta, feasible_systems,
+                                             best_system_index, df)
+    df_within_limit = dataframe_to_sum_of_columns(df_indifference)
+    _cache_store(cache, key, {'count': df_within_limit['sum'].values,
+                              'resamples': boots})
+
+    return indexes_meeting_quality_criteria(alpha, nboots, df_within_limit)
+
+
+def _quality_counts_blocked(data, headers, best_system_index, beta, nboots,
+                            cores, memory_budget, rng=None):
+    """
+    Returns the number of bootstrap mean differences from the best
+    system of each system that are within beta% of the best mean.
+    Systems are bootstrapped in blocks (see iter_bootstrap_blocks).
+    """
+    #pylint: disable-msg=R0913
+    best = np.asarray(data[list(headers).index(best_system_index)])
+    indifference = best.mean() * beta
+    counts = np.empty(data.shape[0], dtype=np.int64)
+
+    for start, stop, boots in iter_bootstrap_blocks(data, nboots,
+                                                    memory_budget, cores,
+                                                    offset=best, rng=rng):
+        counts[start:stop] = (boots <= indifference).sum(axis=1)
+
+    return counts
+
+
+def _quality_counts_statistic(data, best, beta, nboots, statistic, q,
+                              memory_budget, rng=None):
+    """
+    Returns the number of paired bootstrap differences in a statistic
+    from the best system that are within beta% of the best system's
+    statistic.  Each block of systems is bootstrapped from the same seed
+    so that all systems share the same resamples.
+    """
+    #pylint: disable-msg=R0913
+    stat = STATISTICS[statistic]
+    pair_seed = (np.random if rng is None else rng).randint(0, 2**31 - 1)
+
+    best_reps = np.ascontiguousarray(data[best], dtype=np.float64)
+    _seed_numba(pair_seed)
+    best_boots = multi_bootstrap_statistic_paired(best_reps[np.newaxis],
+                                                  nboots, stat, q)[0]
+    indifference = sample_statistic(best_reps, statistic, q) * beta
+
+    counts = np.empty(data.shape[0], dtype=np.int64)
+    block = design_block_size(data.shape[1], nboots, memory_budget)
+
+    for start in range(0, data.shape[0], block):
+        stop = min(start + block, data.shape[0])
+        _seed_numba(pair_seed)
+        boots = multi_bootstrap_statistic_paired(
+            np.ascontiguousarray(data[start:stop], dtype=np.float64),
+            nboots, stat, q)
+        counts[start:stop] = ((boots - best_boots) <= indifference).sum(axis=1)
+
+    return counts
 
 
 def within_x(diffs, x, y, systems, best_system_index, nboots):
@@ -444,7 +1221,8 @@ def indifference_dataframe(x, systems, best_system_index, diffs):
     diffs -- DataFrame of bootstrap datasets of mean differences
     '''
     indifference = systems[best_system_index].mean() * x
-    df_indifference = diffs.applymap(lambda x: indifferent(x, indifference))
+    #vectorised equivalent of applying indifferent() to every value
+    df_indifference = (diffs <= indifference).astype(np.int64)
     return df_indifference
 
 
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Content addressed cache for bootstrap results.
+
+Results are keyed on a hash of the replication data plus every parameter
+that affects the bootstrap (including the random seed).  A small in
+memory LRU tier sits in front of an optional on disk tier of .npz files
+that is limited by total size.
+
+A cache can be shared by jobs running in several threads (see
+bootcomp.threads and bootcomp.service).  Both tiers are guarded by one
+lock and files removed by another process are treated as cache misses.
+
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class BootstrapCache(object):
+    """
+    Two tier (memory and disk) cache of bootstrap results.
+
+    Each entry is a dict of numpy arrays e.g. {'count': ...}.  Full
+    bootstrap datasets are only stored if @store_resamples is True.
+    """
+
+    def __init__(self, path=None, max_items=128, max_bytes=512 * 2**20,
+                 store_resamples=False):
+        """
+        Keyword arguments:
+        path -- directory for the disk tier (default = None i.e. memory only)
+        max_items -- maximum entries held in memory (default = 128)
+        max_bytes -- maximum size of the disk tier (default = 512MB)
+        store_resamples -- also cache the bootstrap datasets
+                           (default = False)
+        """
+        self.path = path
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.store_resamples = store_resamples
+        self._memory = OrderedDict()
+        self._lock = threading.RLock()
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(name, data, **params):
+        """
+        Returns a hex digest identifying a call of @name on @data
+
+        Keyword arguments:
+        name -- name of the bootstrap function
+        data -- numpy array of replications (or a tuple of numpy arrays)
+        params -- all other parameters that affect the result
+        """
+        digest = hashlib.sha256()
+        digest.update(name.encode())
+
+        for arr in (data if isinstance(data, tuple) else (data,)):
+            arr = np.ascontiguousarray(arr)
+            digest.update(str(arr.dtype).encode())
+            digest.update(str(arr.shape).encode())
+            digest.update(memoryview(arr).cast('B'))
+
+        digest.update(repr(sorted(params.items())).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached dict of arrays for @key or None
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            if self.path is None:
+                return None
+
+            file_name = self._file_name(key)
+            try:
+                with np.load(file_name) as stored:
+                    entry = {name: stored[name] for name in stored.files}
+
+                #mark as recently used for disk eviction
+                os.utime(file_name)
+            except FileNotFoundError:
+                return None
+
+            self._remember(key, entry)
+            return entry
+
+    def put(self, key, entry):
+        """
+        Store a dict of arrays under @key
+        """
+        if not self.store_resamples:
+            entry = {name: arr for name, arr in entry.items()
+                     if name != 'resamples'}
+
+        with self._lock:
+            self._remember(key, entry)
+
+            if self.path is not None:
+                np.savez(self._file_name(key), **entry)
+                self._evict()
+
+    def clear(self):
+        """
+        Remove all entries from both tiers
+        """
+        with self._lock:
+            self._memory.clear()
+            for file_name in self._disk_files():
+                _remove(file_name)
+
+    def _remember(self, key, entry):
+        #callers hold self._lock
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _file_name(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def _disk_files(self):
+        if self.path is None:
+            return []
+        return [os.path.join(self.path, f) for f in os.listdir(self.path)
+                if f.endswith('.npz')]
+
+    def _evict(self):
+        """
+        Remove least recently used files until the disk tier fits
+        within max_bytes
+        """
+        files = []
+        for file_name in self._disk_files():
+            try:
+                files.append((os.path.getmtime(file_name),
+                              os.path.getsize(file_name), file_name))
+            except FileNotFoundError:
+                continue
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+
+        while files and total > self.max_bytes:
+            _, size, oldest = files.pop(0)
+            total -= size
+            _remove(oldest)
+
+
+def _remove(file_name):
+    """
+    Remove a file that another process may already have removed
+    """
+    try:
+        os.remove(file_name)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+Statistical equivalence checks of bootstrap engines.
+
+The reference kernels (bootstrap.multi_bootstrap, which calls
+bootstrap, and bootstrap.multi_bootstrap_constraint, which calls
+bootstrap_constraint) are verified exactly in unit_tests.py.  A faster
+engine draws its resamples differently, so it cannot reproduce them
+value for value.  Instead an engine is accepted if:
+
+1. its bootstrap datasets have the same distribution as the reference
+   (two sample Kolmogorov-Smirnov test per system with a Bonferroni
+   correction, plus the mean and standard deviation of the resamples);
+2. the feasible and indifferent systems it selects from the ward model
+   data (data/reps) differ from the reference's no more than two
+   reference runs with different seeds differ from each other.
+
+Each check also reports the speedup over the reference and the peak
+memory of the engine (numpy and Python allocations traced by
+tracemalloc).
+
+Besides the engines in bootcomp.backends.BACKENDS the kernels used for
+systems with unequal replications and for other statistics are checked
+through the wrappers in KERNEL_ENGINES (e.g. check_backend('ragged')).
+
+Example:
+
+    report = check_backend('matmul')
+    assert report['equivalent'], report
+
+"""
+
+import os
+import time
+import tracemalloc
+
+import numpy as np
+from scipy import stats
+
+from bootcomp.bootstrap import (STATISTICS, _count_passes, multi_bootstrap,
+                                multi_bootstrap_constraint,
+                                multi_bootstrap_ragged,
+                                multi_bootstrap_ragged_par,
+                                multi_bootstrap_statistic,
+                                multi_bootstrap_statistic_ragged, set_seed)
+from bootcomp.ragged import RaggedReplications
+from bootcomp.ranking import lexicographic_order
+
+WARD_DATA = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'data', 'reps')
+
+#stage 1 of the ward model tutorial
+WARD_CONSTRAINTS = [('util', 80, 'lower'), ('tran', 50, 'upper')]
+
+
+def reference_engine(data, boots):
+    """
+    The reference bootstrap of the mean (bootstrap.multi_bootstrap)
+    """
+    return multi_bootstrap(data, boots)
+
+
+def ragged_engine(data, boots):
+    """
+    The mean of each system with multi_bootstrap_ragged
+    """
+    ragged = RaggedReplications.from_dense(data)
+    return multi_bootstrap_ragged(ragged.values, ragged.offsets, boots)
+
+
+def ragged_parallel_engine(data, boots):
+    """
+    The mean of each system with multi_bootstrap_ragged_par
+    """
+    ragged = RaggedReplications.from_dense(data)
+    return multi_bootstrap_ragged_par(ragged.values, ragged.offsets, boots)
+
+
+def statistic_engine(data, boots):
+    """
+    The mean of each system with multi_bootstrap_statistic, which
+    resamples by counting how often each replication is drawn
+    """
+    return multi_bootstrap_statistic(data, boots, STATISTICS['mean'], 0.9)
+
+
+def statistic_ragged_engine(data, boots):
+    """
+    The mean of each system with multi_bootstrap_statistic_ragged
+    """
+    ragged = RaggedReplications.from_dense(data)
+    return multi_bootstrap_statistic_ragged(ragged.values, ragged.offsets,
+                                            boots, STATISTICS['mean'], 0.9)
+
+
+KERNEL_ENGINES = {'ragged': ragged_engine,
+                  'ragged_parallel': ragged_parallel_engine,
+                  'statistic': statistic_engine,
+                  'statistic_ragged': statistic_ragged_engine}
+
+
+def count_engine(engine):
+    """
+    Returns an engine that bootstraps the count of replications meeting
+    a threshold (as multi_bootstrap_constraint) by bootstrapping the
+    mean of 1/0 indicators with @engine.
+
+    Keyword arguments:
+    engine -- callable engine(data, boots) of the mean
+    """
+    def counts(data, boots, threshold, kind):
+        if kind == 1:
+            indicators = (data >= threshold).astype(np.float64)
+        else:
+            indicators = (data <= threshold).astype(np.float64)
+        return np.round(engine(indicators, boots) * data.shape[1])
+
+    return counts
+
+
+def distribution_check(engine, data, boots=2000, alpha=0.01, seed=None,
+                       threshold=None, kind=None):
+    """
+    Compare the bootstrap datasets of @engine with the reference kernel
+    system by system.
+
+    Returns a dict of:
+    passed -- True if no system differs at level @alpha (Bonferroni
+              corrected) and the resample means and standard deviations
+              agree
+    min_p -- smallest KS p-value over systems
+    max_mean_z -- largest z statistic of the difference in resample means
+    max_sd_ratio -- largest relative difference in resample standard
+                    deviations
+
+    Keyword arguments:
+    engine -- callable engine(data, boots) of the mean or, if @kind is
+              set, engine(data, boots, threshold, kind) of the count
+    data -- numpy array (systems x replications)
+    boots -- number of bootstrap datasets (default = 2000)
+    alpha -- familywise significance level (default = 0.01)
+    seed -- random seed (default = None)
+    threshold -- threshold of a count bootstrap (default = None)
+    kind -- None = mean; 1 (lower) or 0 (upper) = count bootstrap
+    """
+    #pylint: disable-msg=R0913,R0914
+    set_seed(seed)
+    if kind is None:
+        expected = multi_bootstrap(data, boots)
+        actual = engine(data, boots)
+    else:
+        expected = multi_bootstrap_constraint(data, boots, threshold, kind)
+        actual = engine(data, boots, threshold, kind)
+
+    designs = data.shape[0]
+    p_values = np.ones(designs)
+    for design in range(designs):
+        if np.ptp(expected[design]) > 0 or np.ptp(actual[design]) > 0:
+            p_values[design] = stats.ks_2samp(expected[design],
+                                              actual[design],
+                                              method='asymp').pvalue
+
+    expected_sd = expected.std(axis=1, ddof=1)
+    actual_sd = actual.std(axis=1, ddof=1)
+    pooled = np.sqrt((expected_sd ** 2 + actual_sd ** 2) / boots)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_z = np.abs(expected.mean(axis=1) - actual.mean(axis=1)) / pooled
+        sd_ratio = np.abs(actual_sd / expected_sd - 1)
+
+    mean_z = np.nan_to_num(mean_z)
+    sd_ratio = np.nan_to_num(sd_ratio)
+
+    #the relative error of the standard deviation of @boots resamples is
+    #about 1/sqrt(2 * boots) for normal data; allow more for skewed data
+    limit_z = stats.norm.ppf(1 - alpha / (2 * designs))
+    passed = (p_values.min() >= alpha / designs
+              and mean_z.max() <= limit_z
+              and sd_ratio.max() <= limit_z * np.sqrt(2.0 / boots))
+
+    return {'passed': bool(passed), 'min_p': float(p_values.min()),
+            'max_mean_z': float(mean_z.max()),
+            'max_sd_ratio': float(sd_ratio.max())}
+
+
+def load_ward_data(path=None, n_reps=10):
+    """
+    Returns a dict of numpy arrays (systems x replications) of the ward
+    model KPIs 'wait', 'util' and 'tran'.
+
+    Keyword arguments:
+    path -- directory of the replication files (default = None i.e.
+            data/reps)
+    n_reps -- number of replications to use (default = 10 i.e. stage 1
+              of the tutorial)
+    """
+    if path is None:
+        path = WARD_DATA
+
+    files = {'wait': 'replications_wait_times.csv',
+             'util': 'replications_util.csv',
+             'tran': 'replications_transfers.csv'}
+
+    return {kpi: np.genfromtxt(os.path.join(path, name),
+                               delimiter=',')[:n_reps].T.copy()
+            for kpi, name in files.items()}
+
+
+def two_stage_decisions(engine, kpis, constraints=None, gamma=0.7,
+                        alpha=0.95, beta=0.3, nboots=1000, seed=None):
+    """
+    Apply the chance constraints and quality bootstrap of stage 1 of the
+    ward model tutorial (gamma_1 = 0.7, y_1 = 0.95, x_1 = 0.3 with 10
+    replications) using @engine for every bootstrap.  For stage 2 use
+    gamma=0.95, alpha=0.95, beta=0.05 and load_ward_data(n_reps=50).
+
+    Returns a tuple of numpy arrays (feasible systems, indifferent
+    systems)
+
+    Keyword arguments:
+    engine -- callable engine(data, boots) of the mean
+    kpis -- dict of numpy arrays (systems x replications) with 'wait'
+            first (see load_ward_data)
+    constraints -- list of (kpi, threshold, kind) tuples
+                   (default = None i.e. WARD_CONSTRAINTS)
+    gamma -- the probability cut off for the chance constraints
+             (default = 0.7)
+    alpha -- % of bootstrap samples that must be within tolerance
+             (default = 0.95)
+    beta -- % tolerance of difference from best mean allowed
+            (default = 0.3)
+    nboots -- the number of bootstrap datasets (default = 1000)
+    seed -- random seed (default = None)
+    """
+    #pylint: disable-msg=R0913
+    if constraints is None:
+        constraints = WARD_CONSTRAINTS
+
+    set_seed(seed)
+    n_systems = kpis['wait'].shape[0]
+    passed = np.ones(n_systems, dtype=bool)
+
+    for kpi, threshold, kind in constraints:
+        counts = _count_passes(engine(kpis[kpi], nboots), threshold, kind)
+        passed &= counts / nboots >= gamma
+
+    feasible = np.flatnonzero(passed)
+    if feasible.shape[0] == 0:
+        return feasible, feasible
+
+    means = np.column_stack([kpis[kpi][feasible].mean(axis=1)
+                             for kpi in kpis])
+    best = feasible[lexicographic_order(means)[0]]
+
+    wait = kpis['wait']
+    boots = engine(wait[feasible] - wait[best], nboots)
+    counts = (boots <= wait[best].mean() * beta).sum(axis=1)
+
+    return feasible, feasible[counts >= nboots * alpha]
+
+
+def decision_check(engine, kpis=None, repeats=3, nboots=1000, seed=0,
+                   **kwargs):
+    """
+    Compare the feasible and indifferent systems selected with @engine
+    and with the reference kernel.
+
+    The reference is run twice with different seeds to measure how many
+    systems change because of bootstrap noise alone.  The engine passes
+    if, on average, its selections differ from the reference by no more
+    than that plus one system.
+
+    Returns a dict of:
+    passed -- True if both sets agree
+    feasible_diff, indifferent_diff -- mean number of systems in one
+        set but not the other (engine vs reference)
+    feasible_noise, indifferent_noise -- the same for two reference runs
+
+    Keyword arguments:
+    engine -- callable engine(data, boots) of the mean
+    kpis -- dict of KPIs (default = None i.e. load_ward_data())
+    repeats -- number of seeds compared (default = 3)
+    nboots -- the number of bootstrap datasets (default = 1000)
+    seed -- first random seed (default = 0)
+    kwargs -- passed to two_stage_decisions
+    """
+    #pylint: disable-msg=R0913
+    if kpis is None:
+        kpis = load_ward_data()
+
+    diffs = np.zeros((2, 2))
+    for repeat in range(repeats):
+        base = seed + 3 * repeat
+        reference = two_stage_decisions(reference_engine, kpis,
+                                        nboots=nboots, seed=base, **kwargs)
+        other = two_stage_decisions(reference_engine, kpis, nboots=nboots,
+                                    seed=base + 1, **kwargs)
+        candidate = two_stage_decisions(engine, kpis, nboots=nboots,
+                                        seed=base + 2, **kwargs)
+
+        for stage in range(2):
+            diffs[0, stage] += np.setxor1d(reference[stage],
+                                           candidate[stage]).shape[0]
+            diffs[1, stage] += np.setxor1d(reference[stage],
+                                           other[stage]).shape[0]
+
+    diffs /= repeats
+
+    return {'passed': bool((diffs[0] <= diffs[1] + 1).all()),
+            'feasible_diff': diffs[0, 0], 'indifferent_diff': diffs[0, 1],
+            'feasible_noise': diffs[1, 0], 'indifferent_noise': diffs[1, 1]}
+
+
+def performance(engine, data, boots=1000, repeats=3):
+    """
+    Returns a dict of the best of @repeats run times of @engine and the
+    reference kernel ('time', 'reference_time'), the speedup and the
+    peak memory in bytes of one run of each ('memory',
+    'reference_memory').  Engines are called once first so compilation
+    is not timed.
+    """
+    results = {}
+    for name, func in [('', engine), ('reference_', reference_engine)]:
+        func(data[:2], 2)
+
+        results[name + 'time'] = min(_time(func, data, boots)
+                                     for _ in range(repeats))
+
+        tracemalloc.start()
+        func(data, boots)
+        results[name + 'memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    results['speedup'] = results['reference_time'] / results['time']
+    return results
+
+
+def check_backend(backend, kpis=None, boots=2000, alpha=0.01, seed=0,
+                  repeats=3):
+    """
+    Run every check of a bootstrap engine.
+
+    Returns a dict with 'equivalent' (True only if every check passed),
+    the result of each check ('mean', 'count', 'decisions') and the
+    performance on the ward data ('performance').
+
+    Keyword arguments:
+    backend -- a key of bootcomp.backends.BACKENDS or KERNEL_ENGINES or
+               a callable engine(data, boots) of the mean
+    kpis -- dict of KPIs (default = None i.e. load_ward_data())
+    boots -- bootstrap datasets for the distribution checks
+             (default = 2000)
+    alpha -- familywise significance level (default = 0.01)
+    seed -- random seed (default = 0)
+    repeats -- seeds compared by decision_check (default = 3)
+    """
+    #pylint: disable-msg=R0913
+    engine = backend
+    if backend in KERNEL_ENGINES:
+        engine = KERNEL_ENGINES[backend]
+    elif not callable(backend):
+        from bootcomp.backends import BACKENDS
+        engine = BACKENDS[backend]
+
+    if kpis is None:
+        kpis = load_ward_data()
+
+    #a sample of systems keeps the per system tests quick
+    sample = np.linspace(0, kpis['wait'].shape[0] - 1, 20).astype(np.int64)
+
+    report = {
+        'mean': distribution_check(engine, kpis['wait'][sample], boots,
+                                   alpha, seed),
+        'count': distribution_check(count_engine(engine),
+                                    kpis['util'][sample], boots, alpha,
+                                    seed, threshold=80.0, kind=1),
+        'decisions': decision_check(engine, kpis, repeats, seed=seed),
+        'performance': performance(engine, kpis['wait'])}
+
+    report['equivalent'] = all(report[check]['passed']
+                               for check in ['mean', 'count', 'decisions'])
+    return report
+
+
+def _time(engine, data, boots):
+    start = time.perf_counter()
+    engine(data, boots)
+    return time.perf_counter() - start
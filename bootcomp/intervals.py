@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Bootstrap confidence intervals for every system from one set of
+bootstrap datasets.
+
+Percentile intervals take order statistics of each system's bootstrap
+datasets by partial selection (np.partition) rather than a full sort.
+The bounds of every system are selected together (see order_statistics).
+
+BCa (bias corrected and accelerated) intervals also need the jackknife
+acceleration of each system.  Rather than recomputing the statistic for
+each of the n leave-one-out samples the leave-one-out values are found
+in O(n) from totals (mean and variance) or from the sorted replications
+and suffix sums (quantile and cvar).
+
+"""
+
+import numpy as np
+import pandas as pd
+from numba import jit
+from scipy import stats
+
+from bootcomp.bootstrap import (STATISTICS, _check_statistic,
+                                _multi_bootstrap, _random_state,
+                                weighted_statistic)
+
+VALID_METHODS = ['percentile', 'bca']
+
+
+@jit(nopython=True, nogil=True)
+def leave_one_out(data, order, stat, q):
+    """
+    Returns a numpy array of the statistic of @data with each
+    replication left out in turn (the jackknife samples).  Definitions
+    match weighted_statistic.
+
+    Keyword arguments:
+    data -- numpy array of replications of one system
+    order -- numpy array that sorts @data (np.argsort(data)).  Not used
+             by the mean and variance.
+    stat -- 0 = mean; 1 = variance; 2 = quantile; 3 = cvar (see STATISTICS)
+    q -- probability used by the quantile and cvar statistics
+    """
+    n = data.shape[0]
+    m = n - 1
+    loo = np.empty(n)
+
+    if stat <= 1:
+        #centre first so the totals do not lose precision
+        centre = data.mean()
+        total = 0.0
+        total_sq = 0.0
+        for rep in range(n):
+            total += data[rep] - centre
+            total_sq += (data[rep] - centre) ** 2
+
+        for rep in range(n):
+            x = data[rep] - centre
+            if stat == 0:
+                loo[rep] = centre + (total - x) / m
+            elif m < 2:
+                loo[rep] = np.nan
+            else:
+                rest = total - x
+                loo[rep] = (total_sq - x * x - rest * rest / m) / (m - 1)
+        return loo
+
+    if stat == 2:
+        #rank of the quantile among the remaining replications
+        target = max(1, int(np.ceil(q * m - 1e-9)))
+        for rank in range(n):
+            if rank < target:
+                loo[order[rank]] = data[order[target]]
+            else:
+                loo[order[rank]] = data[order[target - 1]]
+        return loo
+
+    tail = max(1, m - int(np.floor(q * m + 1e-9)))
+
+    #suffix[i] = total of the sorted replications from rank i upward
+    suffix = np.zeros(n + 1)
+    for rank in range(n - 1, -1, -1):
+        suffix[rank] = suffix[rank + 1] + data[order[rank]]
+
+    for rank in range(n):
+        if rank >= n - tail:
+            loo[order[rank]] = (suffix[n - tail - 1] - data[order[rank]]) / tail
+        else:
+            loo[order[rank]] = suffix[n - tail] / tail
+
+    return loo
+
+
+@jit(nopython=True, nogil=True)
+def jackknife_acceleration(data, stat, q):
+    """
+    Returns a numpy array of the BCa acceleration of each system
+
+    Keyword arguments:
+    data -- numpy array (systems x replications)
+    stat -- statistic code (see STATISTICS)
+    q -- probability used by the quantile and cvar statistics
+    """
+    designs = data.shape[0]
+    acceleration = np.zeros(designs)
+
+    #only the quantile and cvar need the replications in order
+    order = np.empty(0, dtype=np.int64)
+
+    for design in range(designs):
+
+        if stat >= 2:
+            order = np.argsort(data[design])
+
+        loo = leave_one_out(data[design], order, stat, q)
+        diffs = loo.mean() - loo
+        spread = (diffs ** 2).sum()
+
+        if spread > 0:
+            acceleration[design] = (diffs ** 3).sum() / (6 * spread ** 1.5)
+
+    return acceleration
+
+
+def order_statistics(boots, ranks):
+    """
+    Returns a numpy array of the order statistic of each system's
+    bootstrap datasets at @ranks.
+
+    Uses partial selection rather than sorting: one partition at the
+    smallest rank and a second at the largest, so only the band of
+    ranks between them is sorted.
+
+    Keyword arguments:
+    boots -- numpy array (systems x boots)
+    ranks -- rank (0 based) for all systems or a numpy array of the
+             rank of each system
+    """
+    ranks = np.broadcast_to(np.asarray(ranks, dtype=np.int64),
+                            boots.shape[:1])
+    low = ranks.min()
+    high = ranks.max()
+
+    band = np.partition(boots, low, axis=1)[:, low:]
+    if high > low:
+        band[:, 1:] = np.partition(band[:, 1:], high - low - 1, axis=1)
+        band = np.sort(band[:, :high - low + 1], axis=1)
+
+    return band[np.arange(boots.shape[0]), ranks - low]
+
+
+def confidence_intervals(data, nboots=1000, confidence=0.95,
+                         methods=('percentile', 'bca'), statistic='mean',
+                         q=0.9, cores='s', seed=None, boots=None):
+    """
+    Bootstrap confidence intervals of a statistic for every system.
+
+    Returns a DataFrame (one row per system) with the sample statistic
+    ('estimate') and <method>_lower and <method>_upper columns for each
+    of @methods.
+
+    Keyword arguments:
+    data -- a numpy array (systems x replications) or a DataFrame
+            (replications x systems)
+    nboots -- the number of bootstrap datasets (default = 1000)
+    confidence -- confidence level of the intervals (default = 0.95)
+    methods -- 'percentile' and/or 'bca' (default = both)
+    statistic -- 'mean' (default), 'variance', 'quantile' or 'cvar'
+    q -- probability used by the quantile and cvar statistics
+         (default = 0.9)
+    cores -- single ('s'), parallel ('p') or 'auto' execution of the
+             bootstrap (default = 's')
+    seed -- random seed for the bootstrap (default = None)
+    boots -- existing bootstrap datasets (systems x boots) of @data to
+             use instead of resampling (default = None)
+    """
+    #pylint: disable-msg=R0913,R0914
+    _check_statistic(statistic, q)
+
+    if not 0 < confidence < 1:
+        raise ValueError('Parameter @confidence must be between 0 and 1')
+
+    for method in methods:
+        if method.lower() not in VALID_METHODS:
+            msg = 'Parameter @methods must only contain {0}'
+            raise ValueError(msg.format(VALID_METHODS))
+
+    index = None
+    if isinstance(data, pd.DataFrame):
+        index = data.columns
+        data = data.values.T
+
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    stat = STATISTICS[statistic]
+
+    if boots is None:
+        rng = _random_state(seed)
+        boots = _multi_bootstrap(data, nboots, cores, statistic, q, rng)
+
+    nboots = boots.shape[1]
+    estimates = _estimates(data, stat, q)
+    tail = (1 - confidence) / 2
+
+    df = pd.DataFrame({'estimate': estimates}, index=index)
+
+    for method in methods:
+        if method.lower() == 'percentile':
+            lower, upper = percentile_ranks(nboots, tail)
+        else:
+            acceleration = jackknife_acceleration(data, stat, q)
+            lower, upper = bca_ranks(boots, estimates, acceleration, tail)
+
+        df['{0}_lower'.format(method.lower())] = order_statistics(boots, lower)
+        df['{0}_upper'.format(method.lower())] = order_statistics(boots, upper)
+
+    return df
+
+
+def percentile_ranks(nboots, tail):
+    """
+    Returns the (0 based) ranks of the lower and upper bounds of a
+    percentile interval with @tail probability in each tail.
+    """
+    return int(_rank(tail, nboots)), int(_rank(1 - tail, nboots))
+
+
+def bca_ranks(boots, estimates, acceleration, tail):
+    """
+    Returns numpy arrays of the (0 based) ranks of the lower and upper
+    bounds of each system's BCa interval.
+
+    Keyword arguments:
+    boots -- numpy array of bootstrap datasets (systems x boots)
+    estimates -- numpy array of the sample statistic of each system
+    acceleration -- numpy array of the acceleration of each system
+    tail -- probability in each tail of the interval
+    """
+    nboots = boots.shape[1]
+    below = (boots < estimates[:, np.newaxis]).sum(axis=1)
+    ties = (boots == estimates[:, np.newaxis]).sum(axis=1)
+
+    #keep the bias correction finite when every resample is on one side
+    prop = np.clip((below + 0.5 * ties) / nboots, 0.5 / nboots,
+                   1 - 0.5 / nboots)
+    bias = stats.norm.ppf(prop)
+
+    ranks = []
+    for z in stats.norm.ppf([tail, 1 - tail]):
+        adjusted = stats.norm.cdf(bias + (bias + z)
+                                  / (1 - acceleration * (bias + z)))
+        ranks.append(_rank(adjusted, nboots))
+
+    return ranks[0], ranks[1]
+
+
+def _rank(prob, nboots):
+    """
+    Rank (0 based) of the smallest bootstrap value with at least @prob
+    of the bootstrap datasets at or below it
+    """
+    rank = np.ceil(np.asarray(prob) * nboots - 1e-9).astype(np.int64) - 1
+    return np.clip(rank, 0, nboots - 1)
+
+
+def _estimates(data, stat, q):
+    if stat == 0:
+        return data.mean(axis=1)
+
+    if stat == 1:
+        return data.var(axis=1, ddof=1)
+
+    return _sample_statistics(data, stat, q)
+
+
+@jit(nopython=True, nogil=True)
+def _sample_statistics(data, stat, q):
+    """
+    weighted_statistic of each system with every replication counted
+    once, so estimates use the same definitions as the resamples
+    """
+    ones = np.ones(data.shape[1], dtype=np.int64)
+    estimates = np.empty(data.shape[0])
+
+    for design in range(data.shape[0]):
+        estimates[design] = weighted_statistic(data[design],
+                                               np.argsort(data[design]),
+                                               ones, stat, q)
+
+    return estimates
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Compact storage for systems with unequal numbers of replications.
+
+All replications are held in one flat buffer.  The replications of
+system i are values[offsets[i]:offsets[i + 1]].
+
+"""
+
+import numpy as np
+
+
+class RaggedReplications(object):
+    """
+    Replications of k systems stored as a flat buffer plus offsets.
+    """
+
+    def __init__(self, values, offsets):
+        """
+        Keyword arguments:
+        values -- numpy array of every replication of every system
+        offsets -- numpy array (k + 1) of the start of each system's
+                   replications in @values.  offsets[-1] == len(values)
+        """
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+
+        if self.offsets[0] != 0 or self.offsets[-1] != self.values.shape[0]:
+            raise ValueError('Parameter @offsets must start at 0 and end at len(values)')
+
+        if (np.diff(self.offsets) < 0).any():
+            raise ValueError('Parameter @offsets must be non-decreasing')
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Create from a list of numpy arrays (one per system)
+        """
+        lengths = np.array([len(arr) for arr in arrays], dtype=np.int64)
+        values = (np.concatenate(arrays) if len(arrays) > 0
+                  else np.empty(0))
+        return cls(values, _offsets(lengths))
+
+    @classmethod
+    def from_dense(cls, data):
+        """
+        Create from a numpy array (systems x replications) where missing
+        replications are NaN
+        """
+        data = np.asarray(data, dtype=np.float64)
+        present = ~np.isnan(data)
+        return cls(data[present], _offsets(present.sum(axis=1)))
+
+    @property
+    def shape(self):
+        """
+        (systems, maximum replications)
+        """
+        lengths = self.lengths()
+        return (lengths.shape[0], int(lengths.max()) if lengths.shape[0] else 0)
+
+    def lengths(self):
+        """
+        Returns a numpy array of the number of replications of each system
+        """
+        return np.diff(self.offsets)
+
+    def means(self):
+        """
+        Returns a numpy array of the mean of each system
+        """
+        lengths = self.lengths()
+        sums = np.bincount(np.repeat(np.arange(len(self)), lengths),
+                           weights=self.values, minlength=len(self))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / lengths
+
+    def take(self, designs):
+        """
+        Returns a new RaggedReplications of the systems at positions @designs
+        """
+        designs = np.asarray(designs, dtype=np.int64)
+        lengths = self.lengths()[designs]
+        starts = self.offsets[designs]
+        #gather every replication of the selected systems in one pass
+        index = (np.repeat(starts - _offsets(lengths)[:-1], lengths)
+                 + np.arange(lengths.sum()))
+        return RaggedReplications(self.values[index], _offsets(lengths))
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, design):
+        return self.values[self.offsets[design]:self.offsets[design + 1]]
+
+
+def _offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Ranking of competing systems on multiple KPIs.
+
+KPI means are computed in a single stacked reduction.  Systems can then
+be ranked lexicographically, by a weighted score or reduced to their
+Pareto front.
+
+"""
+
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+def kpi_means(dfs, subset):
+    """
+    Returns a numpy array (systems x KPIs) of the mean of each KPI for
+    the systems in @subset.
+
+    Keyword arguments:
+    dfs -- list of pandas.DataFrames (replications x systems), one per KPI
+    subset -- list of system labels (columns of each DataFrame)
+    """
+    #each KPI's columns may be in a different order
+    columns = [_column_positions(df, subset) for df in dfs]
+    reps = set(df.shape[0] for df in dfs)
+
+    if len(reps) == 1:
+        #(KPIs x replications x systems) -> one reduction
+        stacked = np.stack([df.values[:, cols]
+                            for df, cols in zip(dfs, columns)])
+        return np.nanmean(stacked, axis=1).T
+
+    return np.column_stack([np.nanmean(df.values[:, cols], axis=0)
+                            for df, cols in zip(dfs, columns)])
+
+
+def _column_positions(df, labels):
+    """
+    Positions of column @labels in @df.  Raises KeyError for a label
+    that is not a column.
+    """
+    positions = df.columns.get_indexer(labels)
+    if (positions < 0).any():
+        missing = list(np.asarray(labels)[positions < 0])
+        raise KeyError('{0} not in index'.format(missing))
+
+    return positions
+
+
+def lexicographic_order(values):
+    """
+    Returns the order of systems sorted by the first KPI, then the
+    second and so on (ascending).
+
+    Keyword arguments:
+    values -- numpy array (systems x KPIs)
+    """
+    #np.lexsort uses the last key as the primary key
+    return np.lexsort(values.T[::-1])
+
+
+def weighted_scores(values, weights, normalise=True):
+    """
+    Returns a weighted score for each system (lower is better).
+
+    Keyword arguments:
+    values -- numpy array (systems x KPIs)
+    weights -- weight of each KPI.  Use a negative weight for a KPI
+               that should be maximised.
+    normalise -- rescale each KPI to the range [0, 1] before weighting
+                 (default = True)
+    """
+    values = np.asarray(values, dtype=np.float64)
+
+    if normalise:
+        low = values.min(axis=0)
+        spread = values.max(axis=0) - low
+        spread[spread == 0] = 1
+        values = (values - low) / spread
+
+    return values @ np.asarray(weights, dtype=np.float64)
+
+
+def pareto_front(values, sense=None):
+    """
+    Returns a boolean numpy array that is True for systems on the
+    Pareto front i.e. that are not dominated by any other system.
+
+    Two and three KPIs are handled in O(K log K) by a sort and sweep.
+    More KPIs fall back to pairwise comparison.
+
+    Keyword arguments:
+    values -- numpy array (systems x KPIs)
+    sense -- 1 (minimise) or -1 (maximise) for each KPI
+             (default = None i.e. minimise all)
+    """
+    values = np.asarray(values, dtype=np.float64)
+
+    if sense is not None:
+        values = values * np.asarray(sense, dtype=np.float64)
+
+    #identical systems do not dominate each other
+    unique, inverse = np.unique(values, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    if unique.shape[1] == 1:
+        front = unique[:, 0] == unique[:, 0].min()
+    elif unique.shape[1] == 2:
+        front = _pareto_front_2d(unique)
+    elif unique.shape[1] == 3:
+        front = _pareto_front_3d(unique)
+    else:
+        front = _pareto_front_nd(unique)
+
+    return front[inverse]
+
+
+def _pareto_front_2d(values):
+    """
+    np.unique sorts lexicographically so a system is non-dominated
+    if its second KPI is below every earlier system's.
+    """
+    running_min = np.minimum.accumulate(values[:, 1])
+    front = np.ones(values.shape[0], dtype=bool)
+    front[1:] = values[1:, 1] < running_min[:-1]
+    return front
+
+
+def _pareto_front_3d(values):
+    """
+    Sweep in lexicographic order keeping a staircase of the
+    non-dominated (KPI 2, KPI 3) pairs seen so far.
+    """
+    front = np.zeros(values.shape[0], dtype=bool)
+    stair_x = []
+    stair_y = []
+
+    for i, (_, x, y) in enumerate(values):
+        pos = bisect_right(stair_x, x)
+
+        #staircase y decreases with x so the closest step on the left
+        #is the strongest candidate to dominate
+        if pos > 0 and stair_y[pos - 1] <= y:
+            continue
+
+        front[i] = True
+        start = bisect_left(stair_x, x)
+        end = start
+        while end < len(stair_x) and stair_y[end] >= y:
+            end += 1
+
+        stair_x[start:end] = [x]
+        stair_y[start:end] = [y]
+
+    return front
+
+
+def _pareto_front_nd(values):
+    front = np.ones(values.shape[0], dtype=bool)
+
+    for i in range(values.shape[0]):
+        if not front[i]:
+            continue
+        dominated = ((values[i] <= values).all(axis=1)
+                     & (values[i] < values).any(axis=1))
+        front[dominated] = False
+
+    return front
@@ -0,0 +1,626 @@
+# -*- coding: utf-8 -*-
+"""
+Local job service for bootstrap comparisons.
+
+A single JobService process holds warm (already compiled) numba kernels
+and a bounded pool of worker threads.  Analysts submit
+constraints_bootstrap, constraints_bootstrap_r1 and quality_bootstrap
+jobs to its queue rather than each importing and compiling bootcomp and
+competing for cores.
+
+Jobs can report progress and be cancelled.  A constraints job given a
+@chunk_size bootstraps that many systems at a time, reporting progress
+and checking for cancellation between chunks.  With a seed and
+cores='s', chunked results are the same as a single call.  With
+cores='auto' each chunk is given its own seed drawn from the job's seed.
+Parallel jobs (cores='p', or an 'auto' choice of 'parallel') are not
+repeatable (see bootcomp.threads).
+
+The service is reached either in process (LocalClient) or over a
+localhost or Unix domain socket of JSON lines (serve and SocketClient).
+Socket clients may only send the arguments in SOCKET_ARGUMENTS, so they
+cannot pass objects (cache) or choose files the service writes
+(boots_file).  A Unix domain socket is only usable by its owner.
+
+Example:
+
+    async with JobService(max_workers=2) as service:
+        client = LocalClient(service)
+        job = await client.submit('constraints_bootstrap', data=util,
+                                  threshold=77, kind='lower',
+                                  chunk_size=100)
+        async for status in client.watch(job):
+            print(status['progress'])
+        feasible = await client.result(job)
+
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from bootcomp.bootstrap import (constraints_bootstrap,
+                                constraints_bootstrap_r1, quality_bootstrap,
+                                _random_state)
+from bootcomp.ragged import RaggedReplications
+
+JOB_FUNCTIONS = {'constraints_bootstrap': constraints_bootstrap,
+                 'constraints_bootstrap_r1': constraints_bootstrap_r1,
+                 'quality_bootstrap': quality_bootstrap}
+
+#functions whose systems can be bootstrapped a chunk at a time
+CHUNKED_FUNCTIONS = ['constraints_bootstrap', 'constraints_bootstrap_r1']
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED = [DONE, FAILED, CANCELLED]
+
+
+class JobCancelled(Exception):
+    """
+    Raised in a worker thread when a running job is cancelled
+    """
+
+
+class Job(object):
+    """
+    A bootstrap call held by a JobService
+    """
+
+    def __init__(self, job_id, name, kwargs):
+        """
+        Keyword arguments:
+        job_id -- identifier of the job within its service
+        name -- key of JOB_FUNCTIONS
+        kwargs -- arguments of the function
+        """
+        self.job_id = job_id
+        self.name = name
+        self.kwargs = kwargs
+        self.state = QUEUED
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.done = asyncio.get_running_loop().create_future()
+        self._watchers = []
+
+    def status(self):
+        """
+        Returns a dict describing the job
+        """
+        return {'job': self.job_id, 'function': self.name,
+                'state': self.state, 'progress': self.progress,
+                'error': self.error}
+
+    def _publish(self):
+        status = self.status()
+        for watcher in self._watchers:
+            watcher.put_nowait(status)
+
+    def _finish(self, state, result=None, error=None):
+        self.state = state
+        self.result = result
+        self.error = error
+        if state == DONE:
+            self.progress = 1.0
+        if not self.done.done():
+            self.done.set_result(state)
+        self._publish()
+
+
+class JobService(object):
+    """
+    Queue of bootstrap jobs run by a bounded pool of worker threads.
+    Use as an async context manager or call start() and stop().
+    """
+
+    def __init__(self, max_workers=2, max_queue=0, warm=True):
+        """
+        Keyword arguments:
+        max_workers -- number of jobs run at the same time (default = 2)
+        max_queue -- maximum number of waiting jobs.  submit() waits for
+                     space when the queue is full (default = 0 i.e.
+                     unlimited)
+        warm -- compile the kernels when the service starts
+                (default = True)
+        """
+        if max_workers < 1:
+            raise ValueError('Parameter @max_workers must be at least 1')
+
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.warm = warm
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._queue = None
+        self._workers = []
+        self._executor = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def start(self):
+        """
+        Compile the kernels (if @warm) and start the workers
+        """
+        self._executor = ThreadPoolExecutor(self.max_workers,
+                                            thread_name_prefix='bootcomp-job')
+        self._queue = asyncio.Queue(self.max_queue)
+
+        if self.warm:
+            await asyncio.get_running_loop().run_in_executor(self._executor,
+                                                             warm_kernels)
+
+        self._workers = [asyncio.ensure_future(self._worker())
+                         for _ in range(self.max_workers)]
+
+    async def stop(self):
+        """
+        Cancel waiting jobs, wait for running jobs and stop the workers
+        """
+        for job in self.jobs.values():
+            if job.state == QUEUED:
+                self.cancel(job.job_id)
+
+        for job in list(self.jobs.values()):
+            if job.state == RUNNING:
+                await job.done
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._executor.shutdown()
+
+    async def submit(self, name, **kwargs):
+        """
+        Add a job to the queue.  Returns the job id.
+
+        Keyword arguments:
+        name -- 'constraints_bootstrap', 'constraints_bootstrap_r1' or
+                'quality_bootstrap'
+        kwargs -- arguments of the function, plus optionally
+                  chunk_size -- systems bootstrapped per step by a
+                  constraints job (default = None i.e. one step)
+        """
+        if name not in JOB_FUNCTIONS:
+            msg = 'Parameter @name must be one of {0}'
+            raise ValueError(msg.format(sorted(JOB_FUNCTIONS)))
+
+        if kwargs.get('chunk_size') is not None \
+                and name not in CHUNKED_FUNCTIONS:
+            raise ValueError('Parameter @chunk_size is only supported by '
+                             + 'constraints jobs')
+
+        if name == 'constraints_bootstrap_r1':
+            #concurrent jobs would overwrite each other's file
+            kwargs.setdefault('boots_file', None)
+
+        job = Job(next(self._ids), name, kwargs)
+        self.jobs[job.job_id] = job
+        await self._queue.put(job)
+        return job.job_id
+
+    def status(self, job_id):
+        """
+        Returns a dict describing job @job_id
+        """
+        return self._job(job_id).status()
+
+    def cancel(self, job_id):
+        """
+        Cancel job @job_id.  A waiting job is cancelled immediately and a
+        running job at its next chunk.  Returns False if the job has
+        already finished.
+        """
+        job = self._job(job_id)
+
+        if job.state in FINISHED:
+            return False
+
+        job.cancel_event.set()
+        if job.state == QUEUED:
+            job._finish(CANCELLED)
+
+        return True
+
+    async def result(self, job_id):
+        """
+        Wait for job @job_id and return its result.
+        Raises JobCancelled if the job was cancelled and RuntimeError if
+        it failed.
+        """
+        job = self._job(job_id)
+        await asyncio.shield(job.done)
+
+        if job.state == CANCELLED:
+            raise JobCancelled('job {0} was cancelled'.format(job_id))
+
+        if job.state == FAILED:
+            raise RuntimeError('job {0} failed: {1}'.format(job_id,
+                                                            job.error))
+
+        return job.result
+
+    async def watch(self, job_id):
+        """
+        Asynchronous generator of the status of job @job_id each time
+        it changes, ending when the job finishes.
+        """
+        job = self._job(job_id)
+        watcher = asyncio.Queue()
+        job._watchers.append(watcher)
+
+        try:
+            status = job.status()
+            yield status
+
+            while status['state'] not in FINISHED:
+                status = await watcher.get()
+                yield status
+        finally:
+            job._watchers.remove(watcher)
+
+    def _job(self, job_id):
+        if job_id not in self.jobs:
+            raise KeyError('unknown job {0}'.format(job_id))
+        return self.jobs[job_id]
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            job = await self._queue.get()
+
+            if job.state != QUEUED:
+                continue
+
+            job.state = RUNNING
+            job._publish()
+
+            def report(progress, job=job):
+                job.progress = progress
+                loop.call_soon_threadsafe(job._publish)
+
+            try:
+                result = await loop.run_in_executor(self._executor,
+                                                    run_job, job.name,
+                                                    job.kwargs, report,
+                                                    job.cancel_event)
+            except JobCancelled:
+                job._finish(CANCELLED)
+            except Exception as error:  #pylint: disable-msg=W0703
+                job._finish(FAILED, error=repr(error))
+            else:
+                job._finish(DONE, result)
+
+
+def warm_kernels():
+    """
+    Compile the numba kernels used by the job functions: serial and
+    parallel, dense and ragged, the mean and the other statistics
+    """
+    #imported here as bootcomp.backends is only needed for warming
+    from bootcomp.backends import multi_bootstrap_prange
+
+    data = np.ones((2, 3))
+    ragged = RaggedReplications.from_dense(data)
+    df = pd.DataFrame(data.T)
+
+    for values in [data, ragged]:
+        constraints_bootstrap_r1(values, 0, nboots=2, boots_file=None)
+        for cores in ['s', 'p']:
+            constraints_bootstrap(values, 0, nboots=2, cores=cores)
+            quality_bootstrap(values, [0, 1], 0, nboots=2, cores=cores)
+
+    constraints_bootstrap(data, 0, nboots=2, statistic='quantile')
+    constraints_bootstrap(ragged, 0, nboots=2, statistic='quantile')
+    quality_bootstrap(df, [0, 1], 0, nboots=2)
+    quality_bootstrap(df, [0, 1], 0, nboots=2, statistic='quantile')
+    multi_bootstrap_prange(data, 2)
+
+
+def run_job(name, kwargs, report=None, cancel_event=None):
+    """
+    Run a job in the calling thread.
+
+    Returns a numpy array of the positions of the systems returned by
+    the job function.
+
+    Keyword arguments:
+    name -- key of JOB_FUNCTIONS
+    kwargs -- arguments of the function (and optionally chunk_size)
+    report -- callable report(progress) called with the proportion of
+              systems complete (default = None)
+    cancel_event -- threading.Event checked between chunks
+                    (default = None)
+    """
+    kwargs = dict(kwargs)
+    chunk_size = kwargs.pop('chunk_size', None)
+    func = JOB_FUNCTIONS[name]
+
+    if chunk_size is None:
+        _check_cancelled(cancel_event)
+        result = np.asarray(func(**kwargs))
+        _report(report, 1.0)
+        return result
+
+    data = kwargs.pop('data')
+    n_systems = data.shape[0]
+
+    #the numba random stream belongs to this thread so seeding once
+    #and bootstrapping chunk by chunk continues the same stream.  The
+    #engines chosen by cores='auto' may not use numba so each chunk
+    #is seeded instead.
+    rng = _random_state(kwargs.pop('seed', None))
+    kwargs.pop('cache', None)
+
+    feasible = []
+    for start in range(0, n_systems, chunk_size):
+        _check_cancelled(cancel_event)
+        if rng is not None and kwargs.get('cores') == 'auto':
+            kwargs['seed'] = int(rng.randint(0, 2**31 - 1))
+
+        stop = min(start + chunk_size, n_systems)
+        if isinstance(data, RaggedReplications):
+            chunk = data.take(np.arange(start, stop))
+        else:
+            chunk = data[start:stop]
+        feasible.append(np.asarray(func(chunk, **kwargs)) + start)
+        _report(report, stop / n_systems)
+
+    return np.concatenate(feasible)
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise JobCancelled()
+
+
+def _report(report, progress):
+    if report is not None:
+        report(progress)
+
+
+class LocalClient(object):
+    """
+    Client of a JobService running in the same event loop
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    async def submit(self, name, **kwargs):
+        """
+        Submit a job.  Returns the job id.
+        """
+        return await self.service.submit(name, **kwargs)
+
+    async def status(self, job_id):
+        """
+        Returns a dict describing the job
+        """
+        return self.service.status(job_id)
+
+    async def cancel(self, job_id):
+        """
+        Cancel the job.  Returns False if it has already finished.
+        """
+        return self.service.cancel(job_id)
+
+    async def result(self, job_id):
+        """
+        Wait for the job and return its result
+        """
+        return await self.service.result(job_id)
+
+    def watch(self, job_id):
+        """
+        Asynchronous generator of the job's status until it finishes
+        """
+        return self.service.watch(job_id)
+
+
+#array arguments sent as nested lists over the socket
+ARRAY_ARGUMENTS = ['data', 'feasible_systems']
+
+#the only job arguments accepted over the socket
+SOCKET_ARGUMENTS = ARRAY_ARGUMENTS + ['threshold', 'nboots', 'gamma', 'kind',
+                                      'cores', 'seed', 'memory_budget',
+                                      'statistic', 'q', 'headers',
+                                      'best_system_index', 'alpha', 'beta',
+                                      'chunk_size']
+
+
+async def serve(service, host='127.0.0.1', port=0, path=None):
+    """
+    Serve @service over a localhost socket or, if @path is set, a Unix
+    domain socket that only the current user can connect to.  Returns an
+    asyncio Server (see server.sockets[0].getsockname() for the port).
+
+    Each request and response is one line of JSON.  Requests are
+    {'op': 'submit', 'function': name, 'kwargs': {...}},
+    {'op': 'status' | 'cancel' | 'result' | 'watch', 'job': job_id}.
+    'watch' responds with a line per status change.  Submitted kwargs
+    must be in SOCKET_ARGUMENTS.
+
+    Keyword arguments:
+    service -- a started JobService
+    host -- address to listen on (default = '127.0.0.1')
+    port -- port to listen on (default = 0 i.e. any free port)
+    path -- file of a Unix domain socket to listen on instead of
+            @host and @port (default = None)
+    """
+    async def handle(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+
+            try:
+                await _respond(service, json.loads(line), writer)
+            except Exception as error:  #pylint: disable-msg=W0703
+                _write(writer, {'error': repr(error)})
+
+            await writer.drain()
+
+        writer.close()
+
+    if path is None:
+        return await asyncio.start_server(handle, host, port)
+
+    #no other user can connect between creating and restricting the file
+    old_umask = os.umask(0o177)
+    try:
+        server = await asyncio.start_unix_server(handle, path)
+    finally:
+        os.umask(old_umask)
+    os.chmod(path, 0o600)
+    return server
+
+
+async def _respond(service, request, writer):
+    op = request['op']
+
+    if op == 'submit':
+        kwargs = dict(request.get('kwargs', {}))
+        unknown = sorted(set(kwargs) - set(SOCKET_ARGUMENTS))
+        if unknown:
+            msg = 'arguments {0} are not accepted over the socket'
+            raise ValueError(msg.format(unknown))
+
+        for name in ARRAY_ARGUMENTS:
+            if name in kwargs:
+                kwargs[name] = np.asarray(kwargs[name], dtype=np.float64)
+
+        if request['function'] == 'constraints_bootstrap_r1':
+            kwargs['boots_file'] = None
+        job_id = await service.submit(request['function'], **kwargs)
+        _write(writer, {'job': job_id})
+    elif op == 'status':
+        _write(writer, service.status(request['job']))
+    elif op == 'cancel':
+        _write(writer, {'cancelled': service.cancel(request['job'])})
+    elif op == 'result':
+        result = await service.result(request['job'])
+        _write(writer, {'result': np.asarray(result).tolist()})
+    elif op == 'watch':
+        async for status in service.watch(request['job']):
+            _write(writer, status)
+            await writer.drain()
+    else:
+        raise ValueError('unknown op {0}'.format(op))
+
+
+def _write(writer, message):
+    writer.write((json.dumps(message) + '\n').encode())
+
+
+class SocketClient(object):
+    """
+    Client of a JobService served over a localhost or Unix domain socket
+    (see serve)
+    """
+
+    def __init__(self, host='127.0.0.1', port=None, path=None):
+        """
+        Keyword arguments:
+        host -- address of the service (default = '127.0.0.1')
+        port -- port of the service (default = None)
+        path -- file of a Unix domain socket to connect to instead of
+                @host and @port (default = None)
+        """
+        self.host = host
+        self.port = port
+        self.path = path
+        self._reader = None
+        self._writer = None
+
+    async def connect(self):
+        """
+        Open the connection to the service
+        """
+        if self.path is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.host, self.port)
+        else:
+            self._reader, self._writer = await asyncio.open_unix_connection(
+                self.path)
+
+    async def close(self):
+        """
+        Close the connection to the service
+        """
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    async def submit(self, name, **kwargs):
+        """
+        Submit a job.  Returns the job id.
+        """
+        for arg in ARRAY_ARGUMENTS:
+            if arg in kwargs:
+                kwargs[arg] = np.asarray(kwargs[arg]).tolist()
+        response = await self._request({'op': 'submit', 'function': name,
+                                        'kwargs': kwargs})
+        return response['job']
+
+    async def status(self, job_id):
+        """
+        Returns a dict describing the job
+        """
+        return await self._request({'op': 'status', 'job': job_id})
+
+    async def cancel(self, job_id):
+        """
+        Cancel the job.  Returns False if it has already finished.
+        """
+        response = await self._request({'op': 'cancel', 'job': job_id})
+        return response['cancelled']
+
+    async def result(self, job_id):
+        """
+        Wait for the job and return its result
+        """
+        response = await self._request({'op': 'result', 'job': job_id})
+        return np.asarray(response['result'], dtype=np.int64)
+
+    async def watch(self, job_id):
+        """
+        Asynchronous generator of the job's status until it finishes.
+        Uses the connection until the job finishes.
+        """
+        _write(self._writer, {'op': 'watch', 'job': job_id})
+        await self._writer.drain()
+
+        while True:
+            status = await self._read()
+            yield status
+            if status['state'] in FINISHED:
+                break
+
+    async def _request(self, request):
+        _write(self._writer, request)
+        await self._writer.drain()
+        return await self._read()
+
+    async def _read(self):
+        response = json.loads(await self._reader.readline())
+        if 'error' in response and 'state' not in response:
+            raise RuntimeError(response['error'])
+        return response
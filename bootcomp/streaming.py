@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming input for stage 1 of the two stage procedure.
+
+Replications are consumed in batches as the simulation model produces
+them.  Per system sufficient statistics and replication buffers are
+maintained incrementally and the chance constraints are re-evaluated
+after every batch so that systems can be screened out while the
+simulation is still running.
+
+"""
+
+import asyncio
+
+import numpy as np
+
+from bootcomp.bootstrap import constraints_bootstrap, constraints_bootstrap_r1
+
+
+class ReplicationStream(object):
+    """
+    Replication buffers and running statistics (count, mean and sum of
+    squared deviations, updated as in Welford's algorithm) for k systems
+    and one or more KPIs.
+
+    A batch is either a dict {kpi: numpy array (systems x replications)}
+    covering every system or a tuple (system indexes, dict) covering a
+    subset of systems.
+    """
+
+    def __init__(self, n_designs, kpis, capacity=16):
+        """
+        Keyword arguments:
+        n_designs -- the number of competing systems
+        kpis -- names of the KPIs in each batch
+        capacity -- initial number of replications buffered per system
+                    (default = 16).  Buffers double in size when full.
+        """
+        self.n_designs = n_designs
+        self.kpis = list(kpis)
+        self.counts = {kpi: np.zeros(n_designs, dtype=np.int64)
+                       for kpi in self.kpis}
+        self.running_means = {kpi: np.zeros(n_designs) for kpi in self.kpis}
+        self.sums_sq_dev = {kpi: np.zeros(n_designs) for kpi in self.kpis}
+        self._buffers = {kpi: np.empty((n_designs, capacity))
+                         for kpi in self.kpis}
+
+    def add_batch(self, batch):
+        """
+        Add a batch of replications to the buffers and statistics
+        """
+        if isinstance(batch, tuple):
+            designs, batch = batch
+            designs = np.asarray(designs, dtype=np.int64)
+        else:
+            designs = np.arange(self.n_designs)
+
+        for kpi, data in batch.items():
+            if kpi not in self._buffers:
+                raise ValueError('Unknown KPI {0} in batch'.format(kpi))
+
+            data = np.asarray(data, dtype=np.float64)
+            if data.ndim == 1:
+                data = data[:, np.newaxis]
+
+            if data.ndim != 2 or data.shape[0] != designs.shape[0]:
+                msg = 'Batch of {0} must have one row per system ({1}) '
+                msg += 'not shape {2}'
+                raise ValueError(msg.format(kpi, designs.shape[0],
+                                            data.shape))
+
+            if data.size == 0:
+                continue
+
+            self._append(kpi, designs, data)
+
+    def _append(self, kpi, designs, data):
+        counts = self.counts[kpi]
+        needed = counts[designs].max() + data.shape[1]
+        buffer = self._buffers[kpi]
+
+        if needed > buffer.shape[1]:
+            capacity = max(needed, 2 * buffer.shape[1])
+            grown = np.empty((self.n_designs, capacity))
+            grown[:, :buffer.shape[1]] = buffer
+            self._buffers[kpi] = buffer = grown
+
+        #systems in a batch usually have the same number of replications
+        start = counts[designs]
+        if (start == start[0]).all():
+            buffer[designs, start[0]:start[0] + data.shape[1]] = data
+        else:
+            for row, design in enumerate(designs):
+                buffer[design, start[row]:start[row] + data.shape[1]] = data[row]
+
+        #merge the batch's mean and squared deviations into the running
+        #values (Chan et al.) rather than keeping raw sums of squares
+        n = counts[designs]
+        batch_n = data.shape[1]
+        total = n + batch_n
+        batch_means = data.mean(axis=1)
+        batch_sq_dev = ((data - batch_means[:, np.newaxis]) ** 2).sum(axis=1)
+        delta = batch_means - self.running_means[kpi][designs]
+
+        self.running_means[kpi][designs] += delta * batch_n / total
+        self.sums_sq_dev[kpi][designs] += (batch_sq_dev
+                                           + delta ** 2 * n * batch_n / total)
+        counts[designs] = total
+
+    def replications(self, kpi, design):
+        """
+        Returns a view of all replications of a system for @kpi
+        """
+        return self._buffers[kpi][design, :self.counts[kpi][design]]
+
+    def data(self, kpi, designs, n_reps):
+        """
+        Returns a numpy array (systems x replications) of the first @n_reps
+        replications of @designs for @kpi
+        """
+        return self._buffers[kpi][designs, :n_reps]
+
+    def means(self, kpi):
+        """
+        Returns the running mean of each system for @kpi
+        """
+        means = self.running_means[kpi].copy()
+        means[self.counts[kpi] == 0] = np.nan
+        return means
+
+    def variances(self, kpi):
+        """
+        Returns the running sample variance of each system for @kpi
+        """
+        n = self.counts[kpi]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums_sq_dev[kpi] / (n - 1)
+
+
+def evaluate_constraints(stream, constraints, gamma, nboots=1000,
+                         method='mean', cores='s', min_reps=2):
+    """
+    Apply the stage 1 chance constraints to the replications buffered
+    so far.  Systems are grouped by their number of replications and
+    each group is passed to constraints_bootstrap (method='mean') or
+    constraints_bootstrap_r1 (method='count').
+
+    Returns a numpy array of the indexes of the systems that meet all
+    constraints.  Systems with fewer than @min_reps replications are
+    not yet feasible.
+
+    Keyword arguments:
+    stream -- ReplicationStream
+    constraints -- list of (kpi, threshold, kind) tuples
+    gamma -- the probability cut off for the chance constraints
+    nboots -- the number of bootstrap datasets (default = 1000)
+    method -- 'mean' or 'count' (default = 'mean')
+    cores -- single or parallel execution (default = 's')
+    min_reps -- minimum replications before a system is evaluated
+                (default = 2)
+    """
+    #pylint: disable-msg=R0913
+
+    valid_methods = ['mean', 'count']
+    if method.lower() not in valid_methods:
+        raise ValueError('Parameter @method must be either set to mean or count')
+
+    passed = np.ones(stream.n_designs, dtype=bool)
+
+    for kpi, threshold, kind in constraints:
+        counts = stream.counts[kpi]
+        kpi_passed = np.zeros(stream.n_designs, dtype=bool)
+
+        for n_reps in np.unique(counts[counts >= min_reps]):
+            designs = np.flatnonzero(counts == n_reps)
+            data = stream.data(kpi, designs, n_reps)
+
+            if method.lower() == 'mean':
+                group = constraints_bootstrap(data, threshold, nboots=nboots,
+                                              gamma=gamma, kind=kind,
+                                              cores=cores)
+            else:
+                group = constraints_bootstrap_r1(data, threshold,
+                                                 nboots=nboots, gamma=gamma,
+                                                 kind=kind, cores=cores,
+                                                 boots_file=None)
+
+            kpi_passed[designs[np.asarray(group, dtype=np.int64)]] = True
+
+        passed &= kpi_passed
+
+    return np.flatnonzero(passed)
+
+
+def stream_constraints(batches, n_designs, constraints, gamma, **kwargs):
+    """
+    Consume an iterator of replication batches and re-evaluate the
+    chance constraints after each batch.
+
+    Yields a tuple of the ReplicationStream and a numpy array of the
+    currently feasible systems after every batch.
+
+    Keyword arguments:
+    batches -- iterator of batches (see ReplicationStream)
+    n_designs -- the number of competing systems
+    constraints -- list of (kpi, threshold, kind) tuples
+    gamma -- the probability cut off for the chance constraints
+    kwargs -- passed to evaluate_constraints
+    """
+    stream = None
+
+    for batch in batches:
+        if stream is None:
+            stream = _new_stream(batch, n_designs)
+
+        stream.add_batch(batch)
+        yield stream, evaluate_constraints(stream, constraints, gamma,
+                                           **kwargs)
+
+
+async def astream_constraints(batches, n_designs, constraints, gamma,
+                              **kwargs):
+    """
+    Asynchronous version of stream_constraints.  Consumes an async
+    iterator of batches.  The bootstrap runs in the default executor so
+    that the event loop is free to receive the next batch.
+    """
+    loop = asyncio.get_running_loop()
+    stream = None
+
+    async for batch in batches:
+        if stream is None:
+            stream = _new_stream(batch, n_designs)
+
+        stream.add_batch(batch)
+        feasible = await loop.run_in_executor(
+            None, lambda: evaluate_constraints(stream, constraints, gamma,
+                                               **kwargs))
+        yield stream, feasible
+
+
+def _new_stream(batch, n_designs):
+    kpis = batch[1].keys() if isinstance(batch, tuple) else batch.keys()
+    return ReplicationStream(n_designs, kpis)
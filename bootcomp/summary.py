@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Summary statistics of many systems and KPIs computed together.
+
+summary_statistics stacks every KPI into one array and computes the
+mean, standard error, count and confidence interval half width of every
+system in a few vectorised passes.  The t quantile is only evaluated
+once per distinct number of replications.
+
+aggregate_xy reduces a large number of (x, y) points to a summary per x
+bin so that charts of 10,000+ systems draw a fixed number of artists.
+
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+def summary_statistics(kpis, confidence=0.95):
+    """
+    Returns a DataFrame (one row per system) with columns for each KPI:
+    <kpi> (mean), <kpi>_sem, n_<kpi> (replications) and <kpi>_hw (half
+    width of the @confidence t interval of the mean).
+
+    Missing replications (NaN) are ignored.
+
+    Keyword arguments:
+    kpis -- dict of DataFrames or numpy arrays (replications x systems)
+            by KPI name.  Every KPI must have the same systems.
+    confidence -- confidence level of the interval (default = 0.95)
+    """
+    if not 0 < confidence < 1:
+        raise ValueError('Parameter @confidence must be between 0 and 1')
+
+    names = list(kpis)
+    first = kpis[names[0]]
+    index = first.columns if isinstance(first, pd.DataFrame) \
+        else pd.RangeIndex(np.asarray(first).shape[1])
+
+    values = _stack([np.asarray(kpis[name], dtype=np.float64)
+                     for name in names])
+
+    n = (~np.isnan(values)).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.nansum(values, axis=1) / n
+        deviations = values - means[:, np.newaxis, :]
+        variances = np.nansum(deviations * deviations, axis=1) / (n - 1)
+        sem = np.sqrt(variances / n)
+
+    half_widths = sem * _t_quantiles(n, confidence)
+
+    columns = {}
+    for i, name in enumerate(names):
+        columns[name] = means[i]
+        columns['{0}_sem'.format(name)] = sem[i]
+        columns['n_{0}'.format(name)] = n[i]
+        columns['{0}_hw'.format(name)] = half_widths[i]
+
+    return pd.DataFrame(columns, index=index)
+
+
+def aggregate_xy(x, y, bins=100):
+    """
+    Summarise points by x.  If there are at most @bins distinct x values
+    each is its own group, otherwise x is split into @bins equal width
+    bins.  Empty bins are dropped.
+
+    Returns a tuple of numpy arrays (x of each group, mean y, min y,
+    max y, number of points).
+
+    Keyword arguments:
+    x -- numpy array of x values
+    y -- numpy array of y values
+    bins -- maximum number of groups (default = 100)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    centres, group = np.unique(x, return_inverse=True)
+
+    if centres.shape[0] > bins:
+        edges = np.linspace(x.min(), x.max(), bins + 1)
+        group = np.clip(np.searchsorted(edges, x, side='right') - 1,
+                        0, bins - 1)
+        centres = (edges[:-1] + edges[1:]) / 2
+
+    counts = np.bincount(group, minlength=centres.shape[0])
+    totals = np.bincount(group, weights=y, minlength=centres.shape[0])
+
+    used = counts > 0
+    order = np.argsort(group, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[used]
+    sorted_y = y[order]
+
+    return (centres[used], totals[used] / counts[used],
+            np.minimum.reduceat(sorted_y, starts),
+            np.maximum.reduceat(sorted_y, starts), counts[used])
+
+
+def _stack(arrays):
+    """
+    Stack (replications x systems) arrays padding shorter ones with NaN
+    """
+    reps = max(arr.shape[0] for arr in arrays)
+    stacked = np.full((len(arrays), reps, arrays[0].shape[1]), np.nan)
+
+    for i, arr in enumerate(arrays):
+        stacked[i, :arr.shape[0]] = arr
+
+    return stacked
+
+
+def _t_quantiles(n, confidence):
+    """
+    t quantiles for an array of sample sizes, evaluated once for each
+    distinct size
+    """
+    sizes, inverse = np.unique(n, return_inverse=True)
+    with np.errstate(invalid='ignore'):
+        quantiles = stats.t.ppf((1 + confidence) / 2.,
+                                np.where(sizes > 1, sizes - 1, np.nan))
+
+    return quantiles[inverse].reshape(n.shape)
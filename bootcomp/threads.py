@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent evaluation of bootstrap jobs in one process.
+
+The numba kernels release the GIL so several calls of
+constraints_bootstrap, constraints_bootstrap_r1 or quality_bootstrap
+(e.g. one per KPI, or one per ward) can run at the same time in a pool
+of threads.  Threads share the caller's arrays so inputs are not copied.
+
+Seeded single core jobs (cores='s', and cores='auto' when it chooses
+the serial, numpy, matmul or process engine) give the same results as
+the same calls made one at a time: each call seeds its own thread's
+numba random stream and passes its own numpy.random.RandomState to the
+numpy engines rather than seeding numpy's global state.  Parallel jobs
+(cores='p') are not repeatable as numba's worker threads have their own
+unseeded random streams.
+
+Example:
+
+    jobs = {'util': (constraints_bootstrap,
+                     dict(data=util, threshold=77, kind='lower')),
+            'tran': (constraints_bootstrap,
+                     dict(data=tran, threshold=50, kind='upper'))}
+    passed = run_jobs(jobs)
+
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bootcomp.bootstrap import (constraints_bootstrap,
+                                constraints_bootstrap_r1, quality_bootstrap)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(max_workers=None):
+    """
+    Returns the shared ThreadPoolExecutor with @max_workers threads.
+    One pool per size is created on first use and reused so threads are
+    not started for every call.  Pools are never shut down while the
+    process runs, so jobs can be submitted from several threads with
+    different sizes.
+
+    Keyword arguments:
+    max_workers -- number of threads (default = None i.e. os.cpu_count())
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    with _pools_lock:
+        if max_workers not in _pools:
+            _pools[max_workers] = ThreadPoolExecutor(
+                max_workers, thread_name_prefix='bootcomp')
+
+        return _pools[max_workers]
+
+
+def submit_job(func, max_workers=None, **kwargs):
+    """
+    Submit a single bootstrap call to the shared pool.
+    Returns a concurrent.futures.Future.
+
+    Keyword arguments:
+    func -- function to call e.g. constraints_bootstrap
+    max_workers -- number of threads (default = None i.e. os.cpu_count())
+    kwargs -- arguments of @func
+    """
+    return get_pool(max_workers).submit(func, **kwargs)
+
+
+def run_jobs(jobs, max_workers=None):
+    """
+    Run bootstrap jobs concurrently and wait for all of them.
+
+    Returns the results in the same structure as @jobs: a dict of
+    results for a dict of jobs, otherwise a list.
+
+    Keyword arguments:
+    jobs -- dict or list of (function, kwargs) tuples
+    max_workers -- number of threads (default = None i.e. os.cpu_count())
+    """
+    if isinstance(jobs, dict):
+        futures = {name: submit_job(func, max_workers, **kwargs)
+                   for name, (func, kwargs) in jobs.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    futures = [submit_job(func, max_workers, **kwargs)
+               for func, kwargs in jobs]
+    return [future.result() for future in futures]
+
+
+def constraints_jobs(data, constraints, **kwargs):
+    """
+    Returns a dict of constraints_bootstrap jobs (see run_jobs), one
+    per chance constraint.
+
+    Keyword arguments:
+    data -- dict of numpy arrays (systems x replications) by KPI name
+    constraints -- list of (kpi, threshold, kind) tuples
+    kwargs -- other arguments of constraints_bootstrap (e.g. gamma, nboots)
+              If kwargs includes method='count' constraints_bootstrap_r1
+              is used instead, without writing df_boots.csv (concurrent
+              jobs would overwrite each other's file).
+    """
+    func = constraints_bootstrap
+    if kwargs.pop('method', 'mean') == 'count':
+        func = constraints_bootstrap_r1
+        kwargs.setdefault('boots_file', None)
+
+    return {kpi: (func, dict(data=data[kpi], threshold=threshold,
+                             kind=kind, **kwargs))
+            for kpi, threshold, kind in constraints}
+
+
+def quality_job(feasible_systems, headers, best_system_index, **kwargs):
+    """
+    Returns a quality_bootstrap job (see run_jobs)
+    """
+    return (quality_bootstrap, dict(feasible_systems=feasible_systems,
+                                    headers=headers,
+                                    best_system_index=best_system_index,
+                                    **kwargs))
@@ -1,9 +1,17 @@
 import pandas as pd
 import numpy as np
-import scipy as sp
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+from functools import lru_cache
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from bootcomp.allocation import sequential_allocation
+from bootcomp.ragged import RaggedReplications
+from bootcomp.ranking import (kpi_means, lexicographic_order, pareto_front,
+                              weighted_scores)
+from bootcomp.summary import aggregate_xy, summary_statistics
 
 def load_systems(file_name, exclude_reps=0, delim=','):
     """
@@ -22,10 +30,27 @@ def load_systems(file_name, exclude_reps=0, delim=','):
     return np.genfromtxt(file_name, delimiter=delim,
                          skip_footer=exclude_reps)
 
+def load_systems_ragged(file_name, delim=','):
+    """
+    Reads scenario data from a .csv file where scenarios may have
+    different numbers of replications (missing cells are blank).
+    Assumes that each column represents a scenario.
+    Returns a bootcomp.ragged.RaggedReplications.
+
+    @file_name = name of file containing csv data
+    @delim = delimiter of file.  Default = ',' for CSV.
+    """
+    data = np.genfromtxt(file_name, delimiter=delim)
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+
+    return RaggedReplications.from_dense(data.T)
+
 def load_model_file(filepath):
     return [filepath + "/" + f for f in os.listdir(filepath) if os.path.isfile(os.path.join(filepath, f))]
 
-def get_best_subset(dfs, labels, subset):
+def get_best_subset(dfs, labels, subset, method='lexicographic',
+                    weights=None):
     """
     Returns the best subset and best systems
     from a collection of performance measures across multiple
@@ -34,27 +59,64 @@ def get_best_subset(dfs, labels, subset):
     dfs -- list of numpy.ndarrys
     labels -- labels/names of numpy.ndarrys in @dfs
     subset -- list of indexes to return 
+    method -- 'lexicographic' = sort by each KPI in the order of @labels;
+              'weighted' = lowest weighted score (default = 'lexicographic')
+    weights -- weight of each KPI when method = 'weighted'
     
     """
-    df_list = []
-    
-    for i in range(len(dfs)):      
-        df_sub = dfs[i][subset].mean()
-        df_sub.rename(labels[i], inplace=True)
-        df_list.append(df_sub)
-        
-    subset_kpi = pd.concat(df_list, axis=1)  
-    
-    best_system_index = subset_kpi.sort_values(by=labels).index[0]
+    valid_methods = ['lexicographic', 'weighted']
+
+    if method.lower() not in valid_methods:
+        raise ValueError('Parameter @method must be either set to lexicographic or weighted')
+
+    if method.lower() == 'weighted' and weights is None:
+        raise ValueError('Parameter @weights must be set when method is weighted')
+
+    subset_kpi = pd.DataFrame(kpi_means(dfs, subset), index=subset,
+                              columns=labels)
+
+    if method.lower() == 'lexicographic':
+        best = lexicographic_order(subset_kpi.values)[0]
+    else:
+        best = np.argmin(weighted_scores(subset_kpi.values, weights))
+
+    best_system_index = subset_kpi.index[best]
     
     return best_system_index, subset_kpi
 
 
-def best_subset_table(df_kpi, indexes, doe_file_name):
+def pareto_subset(subset_kpi, sense=None):
     """
+    Returns the rows of @subset_kpi that lie on the Pareto front
+
+    Keyword arguments:
+    subset_kpi -- DataFrame of KPI means (see get_best_subset)
+    sense -- 1 (minimise) or -1 (maximise) for each KPI
+             (default = None i.e. minimise all)
     """
+    return subset_kpi[pareto_front(subset_kpi.values, sense)]
+
+
+@lru_cache(maxsize=8)
+def _read_doe(doe_file_name, modified):
     df_doe = pd.read_csv(doe_file_name, index_col='System')
     df_doe.index -= 1
+    return df_doe
+
+
+def read_doe(doe_file_name):
+    """
+    Returns the experimental design with a zero based 'System' index.
+    The parsed file is cached until it is modified on disk; each call
+    returns a copy so callers may modify it.
+    """
+    return _read_doe(doe_file_name, os.path.getmtime(doe_file_name)).copy()
+
+
+def best_subset_table(df_kpi, indexes, doe_file_name):
+    """
+    """
+    df_doe = read_doe(doe_file_name)
     df_kpi =  df_kpi[df_kpi.index.isin(indexes)]
     temp = df_doe[df_doe.index.isin(indexes)]
     df_subset_table = pd.concat([temp, df_kpi], axis=1)
@@ -75,6 +137,66 @@ def simulate_stage_2(take_forward, model_file):
    return df_wait_s2,df_util_s2, df_tran_s2
 
 
+def csv_simulator(model_file, n_1):
+    """
+    Stand-in for the simulation model used by sequential allocation.
+    Serves further replications of a system from the .csv files in
+    the order they appear, starting after the first @n_1.
+
+    Returns a callable simulator(design, n) that returns a list of
+    up to n new replications of the waiting time, utilisation and
+    transfers of @design.
+
+    Keyword arguments:
+    model_file -- list of paths to the replication files
+    n_1 -- the number of replications used in stage 1
+    """
+    files = sorted(model_file, reverse=True)
+    kpis = [load_systems(f) for f in files[:3]]
+    served = {}
+
+    def simulator(design, n):
+        start = served.get(design, n_1)
+        stop = min(start + n, kpis[0].shape[0])
+        served[design] = stop
+        return [kpi[start:stop, design] for kpi in kpis]
+
+    return simulator
+
+
+def simulate_stage_2_sequential(take_forward, df_wait, df_util, df_tran,
+                                model_file, min_util, max_tran, gamma,
+                                simulator=None, **kwargs):
+    """
+    Stage 2 of the ward model using sequential allocation of
+    replications (see bootcomp.allocation.sequential_allocation).
+
+    Returns a tuple of the feasible systems, the replications of each
+    system taken forward (list of waiting time, utilisation and transfers)
+    and the pass proportions of the utilisation and transfers constraints.
+
+    Keyword arguments:
+    take_forward -- systems taken forward from stage 1
+    df_wait, df_util, df_tran -- stage 1 replications
+    model_file -- list of paths to the replication files
+    min_util -- minimum utilisation threshold
+    max_tran -- maximum transfers threshold
+    gamma -- the probability cut off for the chance constraints
+    simulator -- callable simulator(design, n).  (default = None
+                 i.e. use csv_simulator)
+    kwargs -- passed to sequential_allocation
+    """
+    #pylint: disable-msg=R0913
+    if simulator is None:
+        simulator = csv_simulator(model_file, df_wait.shape[0])
+
+    stage_1 = [df[take_forward].values.T for df in (df_wait, df_util, df_tran)]
+    constraints = [(1, min_util, 'lower'), (2, max_tran, 'upper')]
+
+    return sequential_allocation(take_forward, stage_1, simulator,
+                                 constraints, gamma, **kwargs)
+
+
 def simulate_stage_1(n_1, model):
     
    files = sorted(model, reverse=True)
@@ -93,31 +215,18 @@ def simulate_stage_1(n_1, model):
    return df_wait, df_util, df_tran
 
 def ward_model_charts(doe_file_path, df_wait, df_util, df_tran):
-    df_doe = pd.read_csv(doe_file_path, index_col='System')
-    df_doe.index -= 1
+    df_doe = read_doe(doe_file_path)
     
     temp = df_doe.loc[df_doe['Number of Bays']==0]
     #temp.index += 1
-    subset_waits = df_wait[temp.index].mean()
-    subset_waits.rename('wait', inplace=True)
-    subset_utils = df_util[temp.index].mean()
-    subset_utils.rename('util', inplace=True)
-    subset_trans = df_tran[temp.index].mean()
-    subset_trans.rename('tran', inplace=True)
-    
-    
-    subset_utils_sem = df_util[temp.index].sem()
-    subset_utils_sem.rename('util_sem', inplace=True)
-    
-    subset_utils_count = df_util[temp.index].count()
-    subset_utils_count.rename('n_util', inplace=True)
+    confidence = 0.95
+    summary = summary_statistics({'wait': df_wait[temp.index],
+                                  'util': df_util[temp.index],
+                                  'tran': df_tran[temp.index]}, confidence)
 
-    subset_kpi = pd.concat([temp, subset_waits, subset_utils, subset_trans, subset_utils_sem, subset_utils_count], axis = 1)
+    subset_kpi = pd.concat([temp, summary], axis = 1)
     subset_kpi['Waiting Time (hrs)'] = round(subset_kpi['wait']*24, 2)
-    
-    confidence = 0.95
-    
-    subset_kpi['hw_95'] = subset_kpi['util_sem'] * sp.stats.t.ppf((1+confidence)/2., subset_kpi['n_util']-1)
+    subset_kpi['hw_95'] = subset_kpi['util_hw']
     
     #fig = plt.figure()
     #ax = fig.add_subplot(111)
@@ -143,3 +252,166 @@ def ward_model_charts(doe_file_path, df_wait, df_util, df_tran):
     
     return fig
 
+
+
+#colours of systems by bootstrap result in design charts
+STATUS_STYLES = [('infeasible', 'lightgrey'),
+                 ('feasible', 'tab:blue'),
+                 ('indifferent', 'tab:red')]
+
+
+def design_status(n_systems, feasible=None, indifferent=None):
+    """
+    Returns a numpy array of the bootstrap result of each system:
+    0 = infeasible, 1 = feasible, 2 = indifferent to the best system.
+    If @feasible is None every system is treated as feasible.
+
+    Keyword arguments:
+    n_systems -- number of systems
+    feasible -- positions of the systems that met the chance constraints
+    indifferent -- positions of the systems returned by quality_bootstrap
+    """
+    status = np.ones(n_systems, dtype=np.int64)
+
+    if feasible is not None:
+        status[:] = 0
+        status[np.asarray(feasible, dtype=np.int64)] = 1
+
+    if indifferent is not None:
+        status[np.asarray(indifferent, dtype=np.int64)] = 2
+
+    return status
+
+
+def label_positions(index, labels):
+    """
+    Returns a numpy array of the positions in @index of system @labels,
+    or None if @labels is None.  Raises KeyError for a label not in
+    @index.
+
+    Keyword arguments:
+    index -- pandas Index of the systems e.g. summary.index
+    labels -- labels of systems in @index
+    """
+    if labels is None:
+        return None
+
+    labels = np.asarray(labels)
+    positions = index.get_indexer(labels)
+
+    if (positions < 0).any():
+        missing = labels[positions < 0].tolist()
+        raise KeyError('{0} not in index'.format(missing))
+
+    return positions
+
+
+def design_chart(summary, x, y, feasible=None, indifferent=None,
+                 yerr=None, max_points=2000, bins=100, ax=None,
+                 figsize=(12, 8)):
+    """
+    Chart a KPI of every design, coloured by the bootstrap results.
+
+    Groups of at most @max_points designs are drawn as points (with
+    error bars if @yerr is set).  Larger groups are aggregated by x
+    (see bootcomp.summary.aggregate_xy) and drawn as the mean and the
+    min to max range so the cost of drawing does not grow with the
+    number of designs.
+
+    The figure is created without pyplot so it can be rendered
+    headless e.g. fig.savefig('designs.png').
+
+    Returns a matplotlib.figure.Figure
+
+    Keyword arguments:
+    summary -- DataFrame with one row per system indexed by system
+               label (e.g. summary_statistics joined with the doe)
+    x -- column of @summary for the x axis
+    y -- column of @summary for the y axis
+    feasible -- labels (@summary index) of feasible systems
+                (default = None)
+    indifferent -- labels (@summary index) of indifferent systems
+                   (default = None)
+    yerr -- column of @summary of error bar half widths (default = None)
+    max_points -- largest group drawn as individual points
+                  (default = 2000)
+    bins -- maximum x groups of an aggregated group (default = 100)
+    ax -- matplotlib axes to draw on (default = None i.e. a new figure)
+    figsize -- size of a new figure (default = (12, 8))
+    """
+    #pylint: disable-msg=R0913,R0914
+    if ax is None:
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+    else:
+        fig = ax.figure
+
+    x_values = summary[x].values
+    y_values = summary[y].values
+    status = design_status(len(summary),
+                           label_positions(summary.index, feasible),
+                           label_positions(summary.index, indifferent))
+
+    for code, (label, colour) in enumerate(STATUS_STYLES):
+        members = np.flatnonzero(status == code)
+        if members.shape[0] == 0:
+            continue
+
+        label = '{0} (n={1})'.format(label, members.shape[0])
+
+        if members.shape[0] <= max_points:
+            error = None if yerr is None else summary[yerr].values[members]
+            ax.errorbar(x_values[members], y_values[members], yerr=error,
+                        fmt='o', color=colour, label=label)
+        else:
+            centres, means, lows, highs, _ = aggregate_xy(x_values[members],
+                                                          y_values[members],
+                                                          bins)
+            ax.fill_between(centres, lows, highs, color=colour, alpha=0.3)
+            ax.plot(centres, means, 'o-', color=colour, label=label)
+
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    ax.grid(True)
+    ax.legend()
+
+    return fig
+
+
+def feasibility_charts(doe_file_path, df_wait, df_util, df_tran, x,
+                       feasible=None, indifferent=None, confidence=0.95,
+                       **kwargs):
+    """
+    Chart the mean waiting time, utilisation and transfers of every
+    design against a column of the doe, coloured by the bootstrap
+    results (see design_chart).
+
+    Returns a matplotlib.figure.Figure
+
+    Keyword arguments:
+    doe_file_path -- path to doe.csv
+    df_wait, df_util, df_tran -- replications (replications x systems)
+                                 with columns labelled by the zero
+                                 based system of the doe
+    x -- column of the doe for the x axis e.g. 'Number of Singles'
+    feasible -- labels (columns) of feasible systems (default = None)
+    indifferent -- labels (columns) of indifferent systems
+                   (default = None)
+    confidence -- confidence level of the error bars (default = 0.95)
+    kwargs -- passed to design_chart
+    """
+    #pylint: disable-msg=R0913
+    summary = summary_statistics({'wait': df_wait, 'util': df_util,
+                                  'tran': df_tran}, confidence)
+    summary[x] = read_doe(doe_file_path).loc[summary.index, x].values
+
+    fig = Figure(figsize=kwargs.pop('figsize', (24, 8)))
+    FigureCanvasAgg(fig)
+
+    for i, kpi in enumerate(['wait', 'util', 'tran']):
+        design_chart(summary, x, kpi, feasible, indifferent,
+                     yerr='{0}_hw'.format(kpi), ax=fig.add_subplot(1, 3, i + 1),
+                     **kwargs)
+
+    return fig
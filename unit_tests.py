@@ -15,7 +15,25 @@ func.__wrapped__
 """
 import numpy as np
 import pandas as pd
+from scipy import stats
 import bootcomp.bootstrap as bs
+import bootcomp.allocation as al
+import bootcomp.streaming as st
+from bootcomp.cache import BootstrapCache
+import bootcomp.ranking as rk
+from bootcomp.ragged import RaggedReplications
+import bootcomp.backends as be
+import bootcomp.threads as th
+import bootcomp.batch as ba
+import bootcomp.service as sv
+import bootcomp.summary as sm
+import bootcomp.intervals as ci
+import bootcomp.equivalence as eq
+import bootcomp.tutorials.ward_model as wm
+import asyncio
+import json
+import os
+import threading
 import pytest
 
 
@@ -360,13 +378,1013 @@ def test_indexes_meeting_quality_criteria():
     y = 0.95
     actual = bs.indexes_meeting_quality_criteria(y, boots, df)
     assert expected == actual.tolist()
-    
-    
 
 
+def test_online_bootstrap_constant_data():
+    '''
+    Bootstrap means of constant replications are unchanged
+    by further replications of the same value
+    '''
+    data = [np.full(5, 2.0), np.full(5, 3.0)]
+    online = al.OnlineBootstrap(data, boots=50)
+    online.update(0, np.full(10, 2.0))
+
+    assert np.allclose(online.means()[0], 2.0)
+    assert np.allclose(online.means()[1], 3.0)
+    assert online.n_reps().tolist() == [15, 5]
+
 
+def test_allocate_replications_ignores_resolved():
+    uncertainty = np.array([0.0, 0.25, 0.05])
+    remaining = np.array([10, 10, 10])
+    actual = al.allocate_replications(uncertainty, 12, remaining)
+    assert actual[0] == 0
+    assert actual[1] == 10
+    assert actual[2] == 2
 
 
-    
+def test_sequential_allocation_only_simulates_uncertain():
+    '''
+    System 0 is clearly feasible, system 1 clearly infeasible.
+    System 2 sits on the threshold so is the only system
+    that should receive further replications.
+    '''
+    stage_1 = [np.array([[100.0, 101, 99, 100, 100],
+                         [10.0, 11, 9, 10, 10],
+                         [45.0, 55, 40, 60, 50]])]
+    requested = []
+
+    def simulator(design, n):
+        requested.append(design)
+        return [np.full(n, 50.0)]
+
+    feasible, reps, props = al.sequential_allocation([0, 1, 2], stage_1,
+                                                     simulator,
+                                                     [(0, 50, 'lower')],
+                                                     gamma=0.95, nboots=200,
+                                                     max_reps=20)
+    assert set(requested) == {2}
+    assert reps[0][2].shape[0] <= 20
+    assert 0 in feasible.tolist()
+    assert 1 not in feasible.tolist()
+
+
+def test_sequential_allocation_no_constraints():
+    stage_1 = [np.ones((3, 5))]
+    with pytest.raises(ValueError):
+        al.sequential_allocation([0, 1, 2], stage_1, None, [], gamma=0.95)
+
+
+def test_replication_stream_statistics():
+    '''
+    Running means and variances match numpy after
+    several batches (including a partial batch)
+    '''
+    data = np.arange(30, dtype=np.float64).reshape(3, 10)
+    stream = st.ReplicationStream(3, ['kpi'], capacity=2)
+    stream.add_batch({'kpi': data[:, :4]})
+    stream.add_batch({'kpi': data[:, 4:9]})
+    stream.add_batch(([1], {'kpi': data[1:2, 9:]}))
+
+    assert stream.counts['kpi'].tolist() == [9, 10, 9]
+    assert np.array_equal(stream.replications('kpi', 1), data[1])
+    assert np.allclose(stream.means('kpi')[1], data[1].mean())
+    assert np.allclose(stream.variances('kpi')[0], data[0, :9].var(ddof=1))
+
+
+def test_replication_stream_empty_and_mismatched_batches():
+    stream = st.ReplicationStream(3, ['kpi'], capacity=2)
+    stream.add_batch(([], {'kpi': np.empty((0, 4))}))
+    stream.add_batch({'kpi': np.empty((3, 0))})
+    assert stream.counts['kpi'].tolist() == [0, 0, 0]
+
+    with pytest.raises(ValueError):
+        stream.add_batch(([0, 1], {'kpi': np.ones((3, 2))}))
+
+
+def test_stream_constraints_screens_systems():
+    '''
+    System 1 violates the lower limit so is screened out
+    once it has enough replications
+    '''
+    data = np.array([[90.0, 91, 89, 90, 90, 91],
+                     [50.0, 51, 49, 50, 50, 51]])
+    batches = ({'util': data[:, i:i + 2]} for i in range(0, 6, 2))
+
+    results = [feasible.tolist() for _, feasible in
+               st.stream_constraints(batches, 2, [('util', 77, 'lower')],
+                                     gamma=0.95, nboots=100)]
+    assert results == [[0], [0], [0]]
+
+
+
+def test_replication_stream_variance_large_offset():
+    '''
+    Running variance stays accurate when the values are
+    large relative to their spread
+    '''
+    data = 1e9 + np.random.RandomState(3).normal(0, 0.01, size=(2, 40))
+    stream = st.ReplicationStream(2, ['kpi'])
+    for i in range(0, 40, 8):
+        stream.add_batch({'kpi': data[:, i:i + 8]})
+
+    assert np.allclose(stream.variances('kpi'), data.var(axis=1, ddof=1),
+                       rtol=1e-6)
+
+
+def test_stream_constraints_count_does_not_write_boots_file(tmp_path,
+                                                            monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = np.array([[90.0, 91, 89, 90], [50.0, 51, 49, 50]])
+    batches = ({'util': data[:, i:i + 2]} for i in range(0, 4, 2))
+    results = list(st.stream_constraints(batches, 2, [('util', 77, 'lower')],
+                                         gamma=0.95, nboots=50,
+                                         method='count'))
+    assert results[-1][1].tolist() == [0]
+    assert not (tmp_path / 'df_boots.csv').exists()
+
+def test_cache_key_depends_on_data_and_params():
+    data = np.arange(10, dtype=np.float64)
+    key = BootstrapCache.key('f', data, seed=1, nboots=10)
+    assert key == BootstrapCache.key('f', data.copy(), nboots=10, seed=1)
+    assert key != BootstrapCache.key('f', data, seed=2, nboots=10)
+    assert key != BootstrapCache.key('f', data + 1, seed=1, nboots=10)
+
+
+def test_cache_memory_lru_and_disk_tier(tmp_path):
+    cache = BootstrapCache(str(tmp_path), max_items=1)
+    cache.put('a', {'count': np.array([1, 2])})
+    cache.put('b', {'count': np.array([3, 4])})
+
+    #'a' has left the memory tier but is still on disk
+    assert 'a' not in cache._memory
+    assert cache.get('a')['count'].tolist() == [1, 2]
+
+    cache.clear()
+    assert cache.get('b') is None
+
+
+def test_cache_disk_tier_size_eviction(tmp_path):
+    cache = BootstrapCache(str(tmp_path), max_items=0, max_bytes=1500)
+    for name in 'abc':
+        cache.put(name, {'count': np.zeros(100)})
+
+    assert cache.get('a') is None
+    assert cache.get('c') is not None
+
+
+def test_cache_shared_by_threads(tmp_path):
+    cache = BootstrapCache(str(tmp_path), max_items=2, max_bytes=3000)
+
+    def use(name):
+        for i in range(50):
+            key = '{0}{1}'.format(name, i % 5)
+            cache.put(key, {'count': np.zeros(50)})
+            cache.get(key)
+            cache.get('a{0}'.format(i % 5))
+        return True
+
+    jobs = [(use, dict(name=name)) for name in 'abcdefgh']
+    assert all(th.run_jobs(jobs, max_workers=8))
+
+
+def test_cache_files_removed_elsewhere(tmp_path, monkeypatch):
+    cache = BootstrapCache(str(tmp_path), max_items=0, max_bytes=0)
+    cache.put('a', {'count': np.zeros(10)})
+    assert cache.get('a') is None
+
+    missing = str(tmp_path / 'gone.npz')
+    monkeypatch.setattr(cache, '_disk_files', lambda: [missing])
+    cache.put('b', {'count': np.zeros(10)})
+    cache.clear()
+
+
+def test_constraints_bootstrap_seed_and_cache():
+    data = np.random.normal(80, 5, size=(20, 5))
+    cache = BootstrapCache()
+    expected = bs.constraints_bootstrap(data, 77, nboots=200, gamma=0.7,
+                                        seed=42)
+    actual = bs.constraints_bootstrap(data, 77, nboots=200, gamma=0.7,
+                                      seed=42, cache=cache)
+    assert expected.tolist() == actual.tolist()
+    assert len(cache._memory) == 1
+
+    #cached hit, and only counts are stored
+    cached = bs.constraints_bootstrap(data, 77, nboots=200, gamma=0.7,
+                                      seed=42, cache=cache)
+    assert expected.tolist() == cached.tolist()
+    assert 'resamples' not in list(cache._memory.values())[0]
+
+
+def test_parallel_seeded_calls_are_not_cached():
+    '''
+    prange worker threads have unseeded numba streams
+    so parallel results cannot be reproduced from a seed
+    '''
+    data = np.random.normal(80, 5, size=(20, 5))
+    cache = BootstrapCache()
+    bs.constraints_bootstrap(data, 77, nboots=200, cores='p', seed=42,
+                             cache=cache)
+    bs.quality_bootstrap(pd.DataFrame(data.T), list(range(20)), 0,
+                         nboots=200, cores='p', seed=42, cache=cache)
+    assert len(cache._memory) == 0
+
+    wide = np.random.normal(80, 5, size=(2, 1000))
+    expected = be.select_backend(2, 1000, 1000) != 'parallel'
+    assert bs._seed_reproducible(wide, 1000, 'auto') == expected
+    assert bs._seed_reproducible(wide, 1000, 'p', statistic='quantile')
+
+
+@pytest.mark.parametrize('store_resamples', [False, True])
+def test_constraints_bootstrap_r1_cache_hit_writes_boots_file(tmp_path,
+                                                              store_resamples):
+    data = np.random.normal(80, 5, size=(6, 5))
+    cache = BootstrapCache(store_resamples=store_resamples)
+    first = str(tmp_path / 'first.csv')
+    second = str(tmp_path / 'second.csv')
+    bs.constraints_bootstrap_r1(data, 77, nboots=50, seed=4, cache=cache,
+                                boots_file=first)
+    bs.constraints_bootstrap_r1(data, 77, nboots=50, seed=4, cache=cache,
+                                boots_file=second)
+    assert pd.read_csv(second).equals(pd.read_csv(first))
+
+
+def test_kpi_means_matches_pandas():
+    dfs = [pd.DataFrame(np.random.rand(5, 8)) for _ in range(3)]
+    subset = [1, 4, 6]
+    expected = np.column_stack([df[subset].mean().values for df in dfs])
+    actual = rk.kpi_means(dfs, subset)
+    assert np.allclose(expected, actual)
+
+
+
+def test_kpi_means_different_column_orders():
+    dfs = [pd.DataFrame(np.random.rand(5, 4)) for _ in range(2)]
+    reordered = [dfs[0], dfs[1][[3, 1, 0, 2]]]
+    subset = [1, 3]
+    expected = np.column_stack([df[subset].mean().values for df in dfs])
+    assert np.allclose(rk.kpi_means(reordered, subset), expected)
+
+    with pytest.raises(KeyError):
+        rk.kpi_means([dfs[0], dfs[1][[0, 1, 2]]], [3])
+
+
+def test_kpi_means_missing_label():
+    dfs = [pd.DataFrame(np.random.rand(5, 4)) for _ in range(2)]
+    with pytest.raises(KeyError):
+        rk.kpi_means(dfs, [0, 99])
+
+def test_lexicographic_order():
+    values = np.array([[2.0, 1.0], [1.0, 5.0], [1.0, 3.0]])
+    assert rk.lexicographic_order(values).tolist() == [2, 1, 0]
+
+
+def test_pareto_front_2d_and_3d():
+    values = np.array([[1.0, 5.0], [2.0, 2.0], [3.0, 3.0], [5.0, 1.0],
+                       [2.0, 2.0]])
+    assert rk.pareto_front(values).tolist() == [True, True, False, True, True]
+
+    values = np.array([[1.0, 5.0, 5.0], [2.0, 1.0, 6.0], [3.0, 2.0, 1.0],
+                       [4.0, 2.0, 6.0], [2.0, 5.0, 5.0]])
+    assert rk.pareto_front(values).tolist() == [True, True, True, False, False]
+
+
+def test_pareto_front_maximise():
+    values = np.array([[1.0, 5.0], [2.0, 6.0], [1.0, 4.0]])
+    assert rk.pareto_front(values, sense=[1, -1]).tolist() == [True, True, False]
+
+
+def test_weighted_scores():
+    values = np.array([[0.0, 10.0], [10.0, 0.0], [5.0, 5.0]])
+    actual = rk.weighted_scores(values, [1, 3])
+    assert np.allclose(actual, [3.0, 1.0, 2.0])
+
+
+def test_design_block_size():
+    #(2 * 5 reps + 95 boots) * 8 bytes = 840 bytes per system
+    assert bs.design_block_size(5, 95, memory_budget=8400) == 10
+    assert bs.design_block_size(5, 95, memory_budget=1) == 1
+
+
+def _to_memmap(arr, file_name):
+    out = np.memmap(file_name, dtype=np.float64, mode='w+', shape=arr.shape)
+    out[:] = arr
+    out.flush()
+    return np.memmap(file_name, dtype=np.float64, mode='r', shape=arr.shape)
+
+
+def test_multi_bootstrap_blocked_memmap(tmp_path):
+    '''
+    Blocked bootstrap of a memmap gives the same
+    result as the in memory bootstrap for the same seed
+    '''
+    data = np.random.rand(12, 5)
+    mapped = _to_memmap(data, str(tmp_path / 'data.dat'))
+    out = np.memmap(str(tmp_path / 'out.dat'), dtype=np.float64, mode='w+',
+                    shape=(12, 20))
+
+    bs.set_seed(7)
+    expected = bs.multi_bootstrap(data, 20)
+    bs.set_seed(7)
+    actual = bs.multi_bootstrap_blocked(mapped, 20, out=out,
+                                        memory_budget=1000)
+    assert np.array_equal(expected, actual)
+
+
+def test_constraints_bootstrap_memmap(tmp_path):
+    data = np.random.normal(78, 3, size=(30, 5))
+    mapped = _to_memmap(data, str(tmp_path / 'data.dat'))
+    expected = bs.constraints_bootstrap(data, 77, nboots=100, gamma=0.7,
+                                        seed=3)
+    actual = bs.constraints_bootstrap(mapped, 77, nboots=100, gamma=0.7,
+                                      seed=3, memory_budget=2000)
+    assert expected.tolist() == actual.tolist()
+
+
+def test_quality_bootstrap_array_input():
+    '''
+    numpy array input (systems x replications) gives
+    the same result as the DataFrame input
+    '''
+    data = np.random.normal(10, 1, size=(5, 8))
+    headers = [3, 5, 7, 9, 11]
+    df = pd.DataFrame(data.T, columns=headers)
+    expected = bs.quality_bootstrap(df, headers, 5, nboots=100, seed=1)
+    actual = bs.quality_bootstrap(data, headers, 5, nboots=100, seed=1,
+                                  memory_budget=5000)
+    assert expected.tolist() == actual.tolist()
+
+
+def test_ragged_from_dense_drops_missing():
+    data = np.array([[1.0, 2.0, np.nan], [3.0, 4.0, 5.0]])
+    ragged = RaggedReplications.from_dense(data)
+    assert ragged.lengths().tolist() == [2, 3]
+    assert ragged[1].tolist() == [3.0, 4.0, 5.0]
+    assert np.allclose(ragged.means(), [1.5, 4.0])
+
+
+def test_ragged_take():
+    ragged = RaggedReplications.from_arrays([np.array([1.0]),
+                                             np.array([2.0, 3.0]),
+                                             np.array([4.0, 5.0, 6.0])])
+    actual = ragged.take([2, 0])
+    assert actual.values.tolist() == [4.0, 5.0, 6.0, 1.0]
+    assert actual.offsets.tolist() == [0, 3, 4]
+
+
+def test_multi_bootstrap_ragged_equal_lengths():
+    '''
+    With equal replication counts the ragged kernel gives
+    the same bootstrap as multi_bootstrap for the same seed
+    '''
+    data = np.random.rand(4, 6)
+    ragged = RaggedReplications.from_dense(data)
+    bs.set_seed(11)
+    expected = bs.multi_bootstrap(data, 25)
+    bs.set_seed(11)
+    actual = bs.multi_bootstrap_ragged(ragged.values, ragged.offsets, 25)
+    assert np.array_equal(expected, actual)
+
+
+def test_multi_bootstrap_ragged_resamples_own_length():
+    ragged = RaggedReplications.from_arrays([np.full(3, 1.0),
+                                             np.full(7, 2.0)])
+    actual = bs.multi_bootstrap_ragged(ragged.values, ragged.offsets, 10)
+    assert np.allclose(actual[0], 1.0)
+    assert np.allclose(actual[1], 2.0)
+
+
+def test_ragged_differences_pair_by_replication():
+    ragged = RaggedReplications.from_arrays([np.array([1.0, 2.0, 3.0]),
+                                             np.array([2.0, 4.0])])
+    diffs, offsets = bs.ragged_differences(ragged.values, ragged.offsets, 1)
+    assert diffs.tolist() == [-1.0, -2.0, 0.0, 0.0]
+    assert offsets.tolist() == [0, 2, 4]
+
+
+@pytest.mark.parametrize('backend', ['serial', 'parallel', 'numpy', 'matmul'])
+def test_backends_shape_and_constant_data(backend):
+    data = np.repeat(np.arange(1.0, 7.0)[:, np.newaxis], 5, axis=1)
+    actual = be.multi_bootstrap_auto(data, 30, backend=backend)
+    assert actual.shape == (6, 30)
+    assert np.allclose(actual, np.arange(1.0, 7.0)[:, np.newaxis])
+
+
+def test_backend_invalid_name():
+    with pytest.raises(ValueError):
+        be.multi_bootstrap_auto(np.zeros((2, 2)), 10, backend='gpu')
+
+
+def test_select_backend_rules(tmp_path):
+    no_file = str(tmp_path / 'missing.json')
+    assert be.select_backend(100, 5, 1000, cores=4, path=no_file) == 'matmul'
+    assert be.select_backend(1, 5, 1000, cores=4, path=no_file) == 'serial'
+    assert be.select_backend(2, 50, 10**5, cores=4, path=no_file) == 'parallel'
+    assert be.select_backend(2, 50, 10**5, cores=1, path=no_file) == 'serial'
+
+    #the weight matrix of matmul is too large for these problems
+    big = dict(reps=10**4, boots=10**4, path=no_file)
+    assert be.select_backend(100, cores=4, **big) == 'process'
+    assert be.select_backend(100, cores=1, **big) == 'serial'
+    assert be.select_backend(100, 5000, 5000, cores=4,
+                             path=no_file) == 'parallel'
+
+
+def test_constraints_bootstrap_r1_rejects_auto_cores():
+    with pytest.raises(ValueError):
+        bs.constraints_bootstrap_r1(np.zeros((2, 5)), 1, cores='auto',
+                                    boots_file=None)
+
+
+def test_calibrate_stores_measurements(tmp_path):
+    path = str(tmp_path / 'backends.json')
+    be.calibrate(path=path, designs=(2,), reps=(5,), boots=(10,),
+                 backends=['serial', 'numpy'], repeats=1)
+    be._calibration.clear()
+
+    calibration = be.load_calibration(path)
+    assert calibration['measurements'][0]['designs'] == 2
+    assert be.select_backend(3, 5, 10, path=path) in ('serial', 'numpy')
+
+
+def test_select_backend_unusable_calibration(tmp_path):
+    '''
+    Calibrations made on another core count, or with only
+    multi-core engines on one core, fall back to the rules
+    '''
+    path = str(tmp_path / 'backends.json')
+    measurement = {'designs': 100, 'reps': 5, 'boots': 1000,
+                   'times': {'parallel': 1.0, 'process': 2.0},
+                   'best': 'parallel'}
+    with open(path, 'w') as stored:
+        json.dump({'cores': 4, 'measurements': [measurement]}, stored)
+    be._calibration.clear()
+
+    assert be.select_backend(100, 5, 1000, cores=4, path=path) == 'parallel'
+    assert be.select_backend(100, 5, 1000, cores=1, path=path) == 'matmul'
+    assert be.select_backend(100, 5, 1000, cores=8, path=path) == 'matmul'
+
+
+def test_constraints_bootstrap_auto_cores():
+    data = np.vstack([np.full(5, 90.0), np.full(5, 50.0)])
+    actual = bs.constraints_bootstrap(data, 77, nboots=50, cores='auto')
+    assert actual.tolist() == [0]
+
+
+def test_kernels_release_gil():
+    for kernel in [bs.bootstrap, bs.bootstrap_par, bs.bootstrap_constraint,
+                   bs.multi_bootstrap, bs.multi_bootstrap_par,
+                   bs.multi_bootstrap_constraint, bs.multi_bootstrap_ragged]:
+        assert kernel.targetoptions['nogil']
+
+
+def test_run_jobs_matches_serial():
+    '''
+    Seeded jobs run in threads give the same result as
+    running them one after another (numba random state
+    is per thread and is seeded inside each job)
+    '''
+    util = np.random.normal(78, 3, size=(40, 5))
+    tran = np.random.normal(50, 5, size=(40, 5))
+    constraints = [('util', 77, 'lower'), ('tran', 50, 'upper')]
+    jobs = th.constraints_jobs({'util': util, 'tran': tran}, constraints,
+                               gamma=0.7, nboots=200, seed=8)
+
+    actual = th.run_jobs(jobs, max_workers=2)
+    expected = bs.constraints_bootstrap(util, 77, gamma=0.7, nboots=200,
+                                        kind='lower', seed=8)
+    assert actual['util'].tolist() == expected.tolist()
+
+    as_list = th.run_jobs(list(jobs.values()), max_workers=2)
+    assert as_list[1].tolist() == actual['tran'].tolist()
+
+
+def test_run_jobs_auto_cores_matches_serial():
+    '''
+    Seeded cores='auto' jobs (numpy engines) run in threads
+    give the same result as running them one after another
+    i.e. no job draws from numpy's global random state
+    '''
+    data = np.random.RandomState(3).normal(77, 2, size=(40, 5))
+    jobs = [(bs.constraints_bootstrap,
+             dict(data=data, threshold=77, kind='lower', gamma=0.5,
+                  nboots=200, cores='auto', seed=seed))
+            for seed in range(8)]
+
+    expected = [func(**kwargs).tolist() for func, kwargs in jobs]
+    assert len(set(map(tuple, expected))) > 1
+
+    for _ in range(3):
+        actual = th.run_jobs(jobs, max_workers=8)
+        assert [result.tolist() for result in actual] == expected
+
+
+def test_get_pool_sizes_do_not_interrupt_jobs():
+    release = threading.Event()
+    first = th.get_pool(2)
+    running = th.submit_job(release.wait, 2, timeout=10)
+    other = th.get_pool(3)
+    release.set()
+
+    assert other is not first
+    assert th.get_pool(2) is first
+    assert running.result()
+    assert th.submit_job(release.is_set, 2).result()
+
+
+def test_quality_job():
+    data = np.random.normal(10, 1, size=(8, 4))
+    df = pd.DataFrame(data)
+    job = th.quality_job(df, [0, 1, 2, 3], 0, nboots=100, seed=2)
+    actual = th.run_jobs([job])[0]
+    expected = bs.quality_bootstrap(df, [0, 1, 2, 3], 0, nboots=100, seed=2)
+    assert actual.tolist() == expected.tolist()
+
+
+@pytest.mark.parametrize('q', [0.1, 0.5, 0.9])
+def test_sample_statistic_matches_numpy(q):
+    data = np.random.normal(size=17)
+    expected = np.quantile(data, q, method='inverted_cdf')
+    assert np.isclose(bs.sample_statistic(data, 'quantile', q), expected)
+
+    tail = 17 - int(np.floor(q * 17))
+    expected = np.sort(data)[-tail:].mean()
+    assert np.isclose(bs.sample_statistic(data, 'cvar', q), expected)
+
+    assert np.isclose(bs.sample_statistic(data, 'variance'), data.var(ddof=1))
+
+
+def test_weighted_statistic_counts():
+    '''
+    A resample given as counts gives the same quantile
+    as sorting the expanded resample
+    '''
+    data = np.array([5.0, 1.0, 3.0, 2.0, 4.0])
+    counts = np.array([0, 2, 0, 1, 2])
+    expanded = np.repeat(data, counts)
+    expected = np.quantile(expanded, 0.5, method='inverted_cdf')
+    actual = bs.weighted_statistic(data, np.argsort(data), counts, 2, 0.5)
+    assert actual == expected
+
+
+def test_bootstrap_statistic_constant_data():
+    data = np.full(10, 3.0)
+    for stat in range(4):
+        actual = bs.bootstrap_statistic(data, 20, stat, 0.9)
+        assert np.allclose(actual, 0.0 if stat == 1 else 3.0)
+
+
+def test_constraints_bootstrap_quantile():
+    '''
+    Both systems have a mean below the threshold but
+    system 1 has a long upper tail
+    '''
+    data = np.vstack([np.full(20, 1.0),
+                      np.r_[np.zeros(15), np.full(5, 10.0)]])
+    means = bs.constraints_bootstrap(data, 5, nboots=200, gamma=0.8,
+                                     kind='upper')
+    p90 = bs.constraints_bootstrap(data, 5, nboots=200, gamma=0.8,
+                                   kind='upper', statistic='quantile', q=0.9)
+    assert means.tolist() == [0, 1]
+    assert p90.tolist() == [0]
+
+
+def test_constraints_bootstrap_invalid_statistic():
+    with pytest.raises(ValueError):
+        bs.constraints_bootstrap(np.zeros((2, 5)), 1, statistic='median')
+
+
+def test_quality_bootstrap_statistic_array_matches_dataframe():
+    data = np.random.normal(10, 2, size=(12, 15))
+    headers = list(range(12))
+    df = pd.DataFrame(data.T)
+    expected = bs.quality_bootstrap(df, headers, 3, nboots=100, seed=4,
+                                    statistic='cvar', beta=0.2)
+    actual = bs.quality_bootstrap(data, headers, 3, nboots=100, seed=4,
+                                  statistic='cvar', beta=0.2,
+                                  memory_budget=5000)
+    assert expected.tolist() == actual.tolist()
+
+
+def _batch_studies():
+    rng = np.random.RandomState(7)
+    studies = []
+    for systems, reps in [(4, 10), (6, 15), (3, 8)]:
+        cost = rng.normal(10, 1, size=(systems, reps))
+        cost[0] += 5
+        util = rng.normal(80, 1, size=(systems, reps))
+        util[-1] -= 20
+        studies.append({'cost': cost, 'util': util})
+    return studies
+
+
+def test_pack_studies_offsets():
+    packed, study_offsets = ba.pack_studies(_batch_studies())
+    assert study_offsets.tolist() == [0, 4, 10, 13]
+    assert packed['cost'].lengths().tolist() == [10] * 4 + [15] * 6 + [8] * 3
+
+
+def test_batch_constraints_matches_per_study():
+    studies = _batch_studies()
+    packed, study_offsets = ba.pack_studies(studies)
+    constraints = [('util', 77, 'lower'), ('cost', [12, 13, 12], 'upper')]
+    for method in ['mean', 'count']:
+        feasible = ba.batch_constraints(packed, study_offsets, constraints,
+                                        gamma=0.9, nboots=500, method=method,
+                                        seed=3)
+        for study, thresholds, actual in zip(studies, [12, 13, 12], feasible):
+            jobs = th.constraints_jobs(study, [('util', 77, 'lower'),
+                                               ('cost', thresholds, 'upper')],
+                                       gamma=0.9, nboots=500, seed=3,
+                                       method=method)
+            passed = th.run_jobs(jobs)
+            expected = np.intersect1d(passed['util'], passed['cost'])
+            assert actual.tolist() == expected.tolist()
+
+
+def test_batch_quality_single_study_matches_quality_bootstrap():
+    study = _batch_studies()[1]
+    packed, study_offsets = ba.pack_studies([study])
+    feasible = [np.arange(6)]
+    actual = ba.batch_quality(packed['cost'], study_offsets, feasible, [2],
+                              nboots=300, beta=0.05, seed=11)[0]
+    expected = bs.quality_bootstrap(RaggedReplications.from_dense(study['cost']),
+                                    list(range(6)), 2, nboots=300, beta=0.05,
+                                    seed=11)
+    assert actual.tolist() == list(expected)
+
+
+def test_batch_two_stage_per_study_results():
+    results = ba.batch_two_stage(_batch_studies(),
+                                 [('util', 77, 'lower')], 'cost',
+                                 gamma=0.9, beta=0.5, nboots=200, seed=1)
+    assert len(results) == 3
+    for (feasible, indifferent), systems in zip(results, [4, 6, 3]):
+        assert feasible.tolist() == list(range(systems - 1))
+        assert set(indifferent) <= set(feasible)
+        assert 0 not in indifferent
+
+
+def test_batch_quality_unsorted_feasible():
+    study = _batch_studies()[1]
+    packed, study_offsets = ba.pack_studies([study])
+    expected = ba.batch_quality(packed['cost'], study_offsets, [np.arange(6)],
+                                [2], nboots=300, beta=0.05, seed=11)[0]
+    actual = ba.batch_quality(packed['cost'], study_offsets,
+                              [[5, 2, 0, 4, 1, 3]], [2], nboots=300,
+                              beta=0.05, seed=11)[0]
+    assert actual.tolist() == expected.tolist()
+
+    with pytest.raises(ValueError):
+        ba.batch_quality(packed['cost'], study_offsets, [[2, 6]], [2])
+
+
+def test_batch_two_stage_parallel_cores():
+    expected = ba.batch_two_stage(_batch_studies(), [('util', 77, 'lower')],
+                                  'cost', gamma=0.9, beta=0.5, nboots=200,
+                                  seed=1)
+    actual = ba.batch_two_stage(_batch_studies(), [('util', 77, 'lower')],
+                                'cost', gamma=0.9, beta=0.5, nboots=200,
+                                seed=1, cores='p')
+    for (feasible, indifferent), (exp_feasible, _) in zip(actual, expected):
+        assert feasible.tolist() == exp_feasible.tolist()
+        assert set(indifferent) <= set(feasible)
+
+    with pytest.raises(ValueError):
+        ba.batch_two_stage(_batch_studies(), [('util', 77, 'lower')], 'cost',
+                           gamma=0.9, cores='auto')
+
+
+def test_batch_constraints_invalid_method():
+    packed, study_offsets = ba.pack_studies(_batch_studies())
+    with pytest.raises(ValueError):
+        ba.batch_constraints(packed, study_offsets, [('util', 77, 'lower')],
+                             0.9, method='median')
+
+
+def test_service_chunked_job_matches_single_call():
+    data = np.random.normal(80, 5, size=(50, 10))
+    expected = bs.constraints_bootstrap(data, 78, nboots=200, seed=5)
+
+    async def run():
+        async with sv.JobService(max_workers=2) as service:
+            client = sv.LocalClient(service)
+            job = await client.submit('constraints_bootstrap', data=data,
+                                      threshold=78, nboots=200, seed=5,
+                                      chunk_size=15)
+            progress = [status['progress']
+                        async for status in client.watch(job)]
+            return await client.result(job), progress
+
+    actual, progress = asyncio.run(run())
+    assert actual.tolist() == list(expected)
+    assert progress[-1] == 1.0
+    assert progress == sorted(progress)
+
+
+def test_run_job_chunks_ragged_data():
+    data = RaggedReplications.from_arrays(
+        [np.random.normal(80, 5, size=n) for n in [5, 8, 3, 6, 7]])
+    expected = bs.constraints_bootstrap(data, 78, nboots=200, seed=5)
+    actual = sv.run_job('constraints_bootstrap',
+                        dict(data=data, threshold=78, nboots=200, seed=5,
+                             chunk_size=2))
+    assert actual.tolist() == list(expected)
+
+
+def test_service_cancel_queued_job():
+    data = np.random.normal(80, 5, size=(5, 10))
+
+    async def run():
+        async with sv.JobService(max_workers=1, warm=False) as service:
+            client = sv.LocalClient(service)
+            first = await client.submit('constraints_bootstrap_r1',
+                                        data=data, threshold=78, nboots=50)
+            second = await client.submit('quality_bootstrap',
+                                         feasible_systems=data,
+                                         headers=list(range(5)),
+                                         best_system_index=0, nboots=50)
+            cancelled = await client.cancel(second)
+            await client.result(first)
+            with pytest.raises(sv.JobCancelled):
+                await client.result(second)
+            return cancelled, await client.status(second)
+
+    cancelled, status = asyncio.run(run())
+    assert cancelled
+    assert status['state'] == sv.CANCELLED
+
+
+def test_service_cancel_running_job_between_chunks():
+    data = np.random.normal(80, 5, size=(20, 10))
+    cancel_event = sv.threading.Event()
+
+    def report(progress):
+        cancel_event.set()
+
+    with pytest.raises(sv.JobCancelled):
+        sv.run_job('constraints_bootstrap',
+                   dict(data=data, threshold=78, nboots=50, chunk_size=5),
+                   report, cancel_event)
+
+
+def test_service_socket_client():
+    data = np.random.normal(10, 1, size=(6, 8))
+    expected = bs.quality_bootstrap(data, list(range(6)), 2, nboots=100,
+                                    seed=3)
+
+    async def run():
+        async with sv.JobService(max_workers=1) as service:
+            server = await sv.serve(service)
+            port = server.sockets[0].getsockname()[1]
+            client = sv.SocketClient(port=port)
+            await client.connect()
+            job = await client.submit('quality_bootstrap',
+                                      feasible_systems=data,
+                                      headers=list(range(6)),
+                                      best_system_index=2, nboots=100,
+                                      seed=3)
+            result = await client.result(job)
+            await client.close()
+            server.close()
+            await server.wait_closed()
+            return result
+
+    assert asyncio.run(run()).tolist() == list(expected)
+
+
+def test_service_unix_socket_restricts_arguments(tmp_path, monkeypatch):
+    '''
+    Socket clients cannot choose files the service writes;
+    only SOCKET_ARGUMENTS are accepted
+    '''
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / 'bootcomp.sock')
+    data = np.random.normal(80, 5, size=(6, 8))
+    expected = bs.constraints_bootstrap_r1(data, 78, nboots=100, seed=3,
+                                           boots_file=None)
+
+    async def run():
+        async with sv.JobService(max_workers=1) as service:
+            server = await sv.serve(service, path=path)
+            assert (tmp_path / 'bootcomp.sock').stat().st_mode & 0o777 == 0o600
+            client = sv.SocketClient(path=path)
+            await client.connect()
+            with pytest.raises(RuntimeError):
+                await client.submit('constraints_bootstrap_r1', data=data,
+                                    threshold=78,
+                                    boots_file=str(tmp_path / 'x.csv'))
+            job = await client.submit('constraints_bootstrap_r1', data=data,
+                                      threshold=78, nboots=100, seed=3)
+            result = await client.result(job)
+            await client.close()
+            server.close()
+            await server.wait_closed()
+            return result
+
+    assert asyncio.run(run()).tolist() == list(expected)
+    assert not any(file.suffix == '.csv' for file in tmp_path.iterdir())
+
+
+def test_service_invalid_function():
+    async def run():
+        async with sv.JobService(warm=False) as service:
+            await service.submit('bootstrap_np', data=None)
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+def test_summary_statistics_matches_pandas():
+    df_util = pd.DataFrame(np.random.normal(80, 5, size=(7, 12)))
+    df_wait = pd.DataFrame(np.random.normal(2, 1, size=(7, 12)))
+    df_wait.iloc[:2, 3] = np.nan
+    summary = sm.summary_statistics({'util': df_util, 'wait': df_wait})
+
+    for name, df in [('util', df_util), ('wait', df_wait)]:
+        assert np.allclose(summary[name], df.mean())
+        assert np.allclose(summary[name + '_sem'], df.sem())
+        assert summary['n_' + name].tolist() == df.count().tolist()
+        expected = df.sem() * stats.t.ppf(0.975, df.count() - 1)
+        assert np.allclose(summary[name + '_hw'], expected)
+
+
+def test_design_chart_statuses_by_label():
+    summary = pd.DataFrame({'x': [1.0, 2.0, 3.0, 4.0],
+                            'y': [5.0, 6.0, 7.0, 8.0]}, index=[10, 11, 12, 13])
+    fig = wm.design_chart(summary, 'x', 'y', feasible=[12, 11],
+                          indifferent=[12])
+    labels = [text.get_text() for text in fig.axes[0].get_legend().get_texts()]
+    assert labels == ['infeasible (n=2)', 'feasible (n=1)',
+                      'indifferent (n=1)']
+
+    with pytest.raises(KeyError):
+        wm.design_chart(summary, 'x', 'y', feasible=[1])
+
+
+def test_feasibility_charts_aligns_doe_by_label():
+    doe = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data',
+                       'doe.csv')
+    df = pd.DataFrame(np.random.normal(10, 1, size=(5, 2)), columns=[3, 1])
+    fig = wm.feasibility_charts(doe, df, df, df, 'Number of Singles')
+    x_values = fig.axes[0].containers[0].lines[0].get_xdata()
+    expected = wm.read_doe(doe).loc[[3, 1], 'Number of Singles']
+    assert list(x_values) == expected.tolist()
+
+
+def test_read_doe_returns_copy():
+    doe = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data',
+                       'doe.csv')
+    df_doe = wm.read_doe(doe)
+    expected = df_doe.iloc[0, 0]
+    df_doe.iloc[0, 0] = -1
+    assert wm.read_doe(doe).iloc[0, 0] == expected
+
+
+def test_aggregate_xy_discrete_and_binned():
+    x = np.array([1, 2, 1, 2, 3])
+    y = np.array([1.0, 5.0, 3.0, 7.0, 4.0])
+    centres, means, lows, highs, counts = sm.aggregate_xy(x, y)
+    assert centres.tolist() == [1, 2, 3]
+    assert means.tolist() == [2.0, 6.0, 4.0]
+    assert lows.tolist() == [1.0, 5.0, 4.0]
+    assert highs.tolist() == [3.0, 7.0, 4.0]
+    assert counts.tolist() == [2, 2, 1]
+
+    x = np.random.rand(1000)
+    centres, means, lows, highs, counts = sm.aggregate_xy(x, x, bins=10)
+    assert centres.shape[0] == 10
+    assert counts.sum() == 1000
+    assert (lows <= means).all() and (means <= highs).all()
+
+
+@pytest.mark.parametrize('statistic', ['mean', 'variance', 'quantile', 'cvar'])
+def test_leave_one_out_matches_refits(statistic):
+    data = np.random.exponential(size=13)
+    stat = bs.STATISTICS[statistic]
+    actual = ci.leave_one_out(data, np.argsort(data), stat, 0.8)
+    expected = [bs.sample_statistic(np.delete(data, i), statistic, 0.8)
+                for i in range(data.shape[0])]
+    assert np.allclose(actual, expected)
+
+
+def test_order_statistics_matches_sort():
+    boots = np.random.normal(size=(50, 200))
+    ranks = np.random.randint(0, 200, size=50)
+    expected = np.sort(boots, axis=1)
+    assert np.array_equal(ci.order_statistics(boots, ranks),
+                          expected[np.arange(50), ranks])
+    assert np.array_equal(ci.order_statistics(boots, 5), expected[:, 5])
+
+
+def test_confidence_intervals_percentile_and_bca():
+    data = np.random.exponential(size=(4, 15))
+    bs.set_seed(8)
+    boots = bs.multi_bootstrap(data, 1000)
+    df = ci.confidence_intervals(data, nboots=1000, seed=8)
+
+    ordered = np.sort(boots, axis=1)
+    assert np.allclose(df['estimate'], data.mean(axis=1))
+    assert np.array_equal(df['percentile_lower'], ordered[:, 24])
+    assert np.array_equal(df['percentile_upper'], ordered[:, 974])
+
+    for i, system in enumerate(data):
+        loo = np.array([np.delete(system, j).mean()
+                        for j in range(system.shape[0])])
+        diffs = loo.mean() - loo
+        accel = (diffs ** 3).sum() / (6 * (diffs ** 2).sum() ** 1.5)
+        bias = stats.norm.ppf((boots[i] < system.mean()).mean())
+        z = stats.norm.ppf(0.975)
+        prob = stats.norm.cdf(bias + (bias + z) / (1 - accel * (bias + z)))
+        rank = int(np.ceil(prob * 1000)) - 1
+        assert df['bca_upper'][i] == ordered[i, rank]
+
+
+@pytest.mark.parametrize('statistic', ['variance', 'quantile', 'cvar'])
+def test_confidence_intervals_estimates_and_acceleration(statistic):
+    data = np.random.exponential(size=(3, 12))
+    df = ci.confidence_intervals(data, nboots=100, methods=['percentile'],
+                                 statistic=statistic, q=0.8)
+    expected = [bs.sample_statistic(system, statistic, 0.8)
+                for system in data]
+    assert np.allclose(df['estimate'], expected)
+
+    stat = bs.STATISTICS[statistic]
+    accel = ci.jackknife_acceleration(data, stat, 0.8)
+    for i, system in enumerate(data):
+        loo = np.array([bs.sample_statistic(np.delete(system, j),
+                                            statistic, 0.8)
+                        for j in range(system.shape[0])])
+        diffs = loo.mean() - loo
+        expected = (diffs ** 3).sum() / (6 * (diffs ** 2).sum() ** 1.5)
+        assert np.isclose(accel[i], expected)
+
+
+def test_confidence_intervals_dataframe_index():
+    df = pd.DataFrame(np.random.normal(size=(10, 3)), columns=[4, 7, 9])
+    intervals = ci.confidence_intervals(df, nboots=200, methods=['bca'],
+                                        statistic='quantile', q=0.5)
+    assert intervals.index.tolist() == [4, 7, 9]
+    assert (intervals['bca_lower'] <= intervals['bca_upper']).all()
+
+    with pytest.raises(ValueError):
+        ci.confidence_intervals(df, methods=['studentized'])
+
+
+def _short_bootstrap(data, boots):
+    '''
+    A faulty engine that resamples 3 too few replications
+    '''
+    n = data.shape[1]
+    index = np.random.randint(0, n, size=(data.shape[0], boots, n - 3))
+    rows = np.arange(data.shape[0])[:, np.newaxis, np.newaxis]
+    return data[rows, index].mean(axis=2)
+
+
+def test_distribution_check_matmul_engine():
+    data = np.random.RandomState(1).exponential(size=(8, 10))
+    result = eq.distribution_check(be.multi_bootstrap_matmul, data,
+                                   seed=2)
+    assert result['passed']
+
+    counts = eq.count_engine(be.multi_bootstrap_matmul)
+    result = eq.distribution_check(counts, data, seed=2, threshold=1.0,
+                                   kind=1)
+    assert result['passed']
+
+
+def test_distribution_check_detects_faulty_engine():
+    data = np.random.RandomState(1).exponential(size=(8, 10))
+    result = eq.distribution_check(_short_bootstrap, data, seed=2)
+    assert not result['passed']
+
+
+def test_decision_check_ward_data():
+    kpis = eq.load_ward_data()
+    assert kpis['wait'].shape == (1051, 10)
+
+    result = eq.decision_check(be.multi_bootstrap_matmul, kpis, repeats=2,
+                               nboots=500)
+    assert result['passed']
+
+
+@pytest.mark.parametrize('backend', sorted(be.BACKENDS)
+                         + sorted(eq.KERNEL_ENGINES))
+def test_check_backend_equivalent(backend):
+    '''
+    Every engine and kernel passes the equivalence checks
+    on a sample of the ward systems
+    '''
+    sample = np.arange(0, 1051, 7)
+    kpis = {kpi: data[sample] for kpi, data in eq.load_ward_data().items()}
+    report = eq.check_backend(backend, kpis, boots=500, alpha=0.001,
+                              repeats=1)
+    assert report['equivalent'], report
+
 
-       
+def test_check_backend_report():
+    kpis = {kpi: data[:200] for kpi, data in eq.load_ward_data().items()}
+    report = eq.check_backend('numpy', kpis, boots=500, repeats=1)
+    assert report['equivalent']
+    assert report['performance']['speedup'] > 0
+    assert report['performance']['memory'] > 0